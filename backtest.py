@@ -0,0 +1,290 @@
+import csv
+from heapq import merge
+from datetime import datetime
+from upstox_api import api as upstox
+from routing import Router
+from models import Tick
+from utils import BUY, SELL, create_logger
+
+OPEN = 'open'
+COMPLETE = 'complete'
+CANCELLED = 'cancelled'
+REJECTED = 'rejected'
+
+
+def make_instrument(symbol, exchange='nse_fo', token=0, closing_price=None):
+    return upstox.Instrument(exchange, token, None, symbol.upper(), symbol.upper(),
+                             closing_price, None, None, 0.05, 1, None, None)
+
+
+def quote(instrument, ts, ltp):
+    return {'timestamp': ts,
+            'exchange': instrument.exchange,
+            'symbol': instrument.symbol,
+            'instrument': instrument,
+            'ltp': ltp}
+
+
+def ticks_from_reader(reader, instrument):
+    for ts, ltp, volume, bid, ask in reader.rows():
+        yield quote(instrument, ts, ltp)
+
+
+def ticks_from_ohlc(bars, instrument):
+    '''
+    Expands each bar into open, high/low, close ticks. The high comes
+    first on down bars so stops and targets trigger in a plausible order.
+    '''
+    for bar in bars:
+        ts = int(bar['timestamp'])
+        o, h, l, c = (float(bar[k]) for k in ('open', 'high', 'low', 'close'))
+        path = (o, l, h, c) if c >= o else (o, h, l, c)
+        for i, price in enumerate(path):
+            yield quote(instrument, ts + i, price)
+
+
+def _parse_ts(value):
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    for fmt in ('%d-%m-%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp() * 1000)
+        except ValueError:
+            continue
+    raise ValueError('Unknown timestamp format %s' % value)
+
+
+def ticks_from_csv(path, instrument):
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        row['timestamp'] = _parse_ts(row['timestamp'])
+    if rows and 'ltp' in rows[0]:
+        return (quote(instrument, row['timestamp'], float(row['ltp'])) for row in rows)
+    return ticks_from_ohlc(rows, instrument)
+
+
+def merge_ticks(*sources):
+    return merge(*sources, key=lambda q: q['timestamp'])
+
+
+class SimOrder:
+    __slots__ = ('order_id', 'parent_order_id', 'instrument', 'side', 'quantity',
+                 'order_type', 'price', 'trigger', 'status', 'children')
+
+    def __init__(self, order_id, instrument, side, quantity, order_type, price,
+                 trigger=None, parent_order_id='NA'):
+        self.order_id = order_id
+        self.parent_order_id = parent_order_id
+        self.instrument = instrument
+        self.side = side
+        self.quantity = quantity
+        self.order_type = order_type
+        self.price = price
+        self.trigger = trigger
+        self.status = OPEN
+        self.children = ()
+
+    def triggered(self, ltp):
+        if self.order_type == upstox.OrderType.Market:
+            return True
+        if self.trigger is not None:
+            return ltp <= self.trigger if self.side == SELL else ltp >= self.trigger
+        return ltp <= self.price if self.side == BUY else ltp >= self.price
+
+
+class SimulatedBroker:
+    '''
+    Matches Limit, Market and OCO orders against replayed ltps. An OCO
+    entry spawns a target and a stoploss leg when it fills, whichever
+    leg fills first cancels the other. Orders placed on a tick can only
+    fill from the next tick onward.
+    '''
+    def __init__(self):
+        self.next_id = 1
+        self.book = {}
+        self.positions = {}
+        self.avg_price = {}
+        self.last_price = {}
+        self.realised = 0.0
+        self.trades = []
+        self.orders = 0
+
+    def place(self, order, ts):
+        inst = order['instrument']
+        side = order['transaction'].value
+        if order['quantity'] <= 0:
+            o = SimOrder(str(self.next_id), inst, side, order['quantity'],
+                         order['order_type'], order['buy_price'])
+            self.next_id += 1
+            self.orders += 1
+            o.status = REJECTED
+            update = self._order_update(o, ts)
+            update['message'] = 'Quantity must be positive'
+            return [('o', update)]
+        o = self._new(inst, side, order['quantity'], order['order_type'], order['buy_price'])
+        events = [('o', self._order_update(o, ts))]
+        if order['product'] == upstox.ProductType.OneCancelsOther:
+            exit_side = SELL if side == BUY else BUY
+            sign = 1 if side == BUY else -1
+            target = self._new(inst, exit_side, o.quantity, upstox.OrderType.Limit,
+                               o.price + sign * order['target'], parent=o.order_id)
+            stop = self._new(inst, exit_side, o.quantity, upstox.OrderType.StopLossMarket,
+                             None, trigger=o.price - sign * order['stoploss'],
+                             parent=o.order_id)
+            target.status = stop.status = 'pending'
+            o.children = (target, stop)
+        return events
+
+    def match(self, tick):
+        sym = tick['symbol'].lower()
+        ltp = tick['ltp']
+        self.last_price[sym] = ltp
+        book = self.book.get(sym)
+        if not book:
+            return ()
+        events = []
+        for o in list(book):
+            if o.status != OPEN or not o.triggered(ltp):
+                continue
+            price = ltp if o.price is None or o.order_type == upstox.OrderType.Market else o.price
+            self._fill(o, price, tick['timestamp'], events)
+        self.book[sym] = [o for o in self.book[sym] if o.status in (OPEN, 'pending')]
+        return events
+
+    def unrealised(self):
+        total = 0.0
+        for sym, qty in self.positions.items():
+            if qty:
+                total += qty * (self.last_price.get(sym, self.avg_price[sym]) - self.avg_price[sym])
+        return total
+
+    def _new(self, inst, side, quantity, order_type, price, trigger=None, parent='NA'):
+        o = SimOrder(str(self.next_id), inst, side, quantity, order_type, price,
+                     trigger, parent)
+        self.next_id += 1
+        self.orders += 1
+        self.book.setdefault(inst.symbol.lower(), []).append(o)
+        return o
+
+    def _fill(self, o, price, ts, events):
+        o.status = COMPLETE
+        sym = o.instrument.symbol.lower()
+        qty = o.quantity if o.side == BUY else -o.quantity
+        pos = self.positions.get(sym, 0)
+        avg = self.avg_price.get(sym, 0.0)
+        if pos == 0 or (pos > 0) == (qty > 0):
+            if pos + qty:
+                avg = (avg * abs(pos) + price * abs(qty)) / abs(pos + qty)
+        else:
+            closed = min(abs(pos), abs(qty))
+            self.realised += closed * (price - avg) * (1 if pos > 0 else -1)
+            if abs(qty) > abs(pos):
+                avg = price
+        self.positions[sym] = pos + qty
+        self.avg_price[sym] = avg if pos + qty else 0.0
+
+        trade = self._trade(o, price, ts)
+        self.trades.append(trade)
+        events.append(('o', self._order_update(o, ts)))
+        events.append(('t', trade))
+        for child in o.children:
+            child.status = OPEN
+            events.append(('o', self._order_update(child, ts)))
+        if o.parent_order_id != 'NA':
+            for sibling in self.book.get(sym, ()):
+                if sibling.parent_order_id == o.parent_order_id and sibling.status == OPEN:
+                    sibling.status = CANCELLED
+                    events.append(('o', self._order_update(sibling, ts)))
+
+    def _order_update(self, o, ts):
+        return {'timestamp': ts,
+                'exchange': o.instrument.exchange,
+                'symbol': o.instrument.symbol,
+                'instrument': o.instrument,
+                'order_id': o.order_id,
+                'parent_order_id': o.parent_order_id,
+                'transaction_type': o.side,
+                'quantity': o.quantity,
+                'price': o.price,
+                'trigger_price': o.trigger,
+                'status': o.status,
+                'message': ''}
+
+    def _trade(self, o, price, ts):
+        return {'timestamp': ts,
+                'exchange': o.instrument.exchange,
+                'symbol': o.instrument.symbol,
+                'instrument': o.instrument,
+                'order_id': o.order_id,
+                'parent_order_id': o.parent_order_id,
+                'transaction_type': o.side,
+                'quantity': o.quantity,
+                'traded_quantity': o.quantity,
+                'traded_price': price,
+                'message': COMPLETE}
+
+
+class _Pinned:
+    def __init__(self, strategy, symbols):
+        self.strategy = strategy
+        self.symbols = symbols
+        self.process_quote = strategy.process_quote
+        self.process_order = strategy.process_order
+        self.process_trade = strategy.process_trade
+
+    def get_symbols(self):
+        return self.symbols
+
+
+class ReplayEngine:
+    '''
+    Drives strategies through process_quote/process_order/process_trade
+    exactly like Manager does, but from a tick iterator and against a
+    SimulatedBroker instead of the upstox client.
+    '''
+    def __init__(self, broker=None, refresh_every=1000):
+        self.logger = create_logger(self.__class__.__name__)
+        self.broker = broker or SimulatedBroker()
+        self.router = Router()
+        self.refresh_every = refresh_every
+        self.ticks = 0
+
+    def add_strategy(self, bot, symbols=None):
+        if symbols is not None:
+            bot = _Pinned(bot, symbols)
+        self.router.add(bot)
+
+    def run(self, ticks):
+        router = self.router
+        broker = self.broker
+        for message in ticks:
+            tick = Tick(message)
+            self._dispatch(broker.match(tick))
+            ts = tick.timestamp
+            for bot in router.get(tick.symbol):
+                order = bot.process_quote(tick)
+                if order is not None:
+                    self._dispatch(broker.place(order, ts))
+            self.ticks += 1
+            if self.ticks % self.refresh_every == 0:
+                router.refresh()
+        return self.results()
+
+    def results(self):
+        return {'ticks': self.ticks,
+                'orders': self.broker.orders,
+                'trades': len(self.broker.trades),
+                'realised': self.broker.realised,
+                'unrealised': self.broker.unrealised(),
+                'positions': {k: v for k, v in self.broker.positions.items() if v}}
+
+    def _dispatch(self, events):
+        for kind, m in events:
+            for bot in self.router.get(m['symbol'].lower()):
+                if kind == 'o':
+                    bot.process_order(m)
+                else:
+                    bot.process_trade(m)
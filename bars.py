@@ -0,0 +1,217 @@
+from collections import deque
+from datetime import datetime, date, timedelta
+from threading import Lock
+from time import time
+from upstox_api import api as upstox
+from utils import create_logger
+
+BAR_HISTORY = 500
+BAR_GRACE = 500
+DAY = 'day'
+# ms per bar, day bars follow the local calendar day instead
+INTERVALS = {'1m': 60000, '5m': 300000, '15m': 900000, DAY: None}
+# rest interval each one is stitched from, 15m has no rest equivalent
+HISTORY_INTERVALS = {'1m': upstox.OHLCInterval.Minute_1,
+                     '5m': upstox.OHLCInterval.Minute_5,
+                     '15m': upstox.OHLCInterval.Minute_5,
+                     DAY: upstox.OHLCInterval.Day_1}
+
+
+def interval_name(interval):
+    '''Bar interval name for an OHLCInterval, None if bars are not built for it'''
+    for name, ohlc in HISTORY_INTERVALS.items():
+        if ohlc == interval and name != '15m':
+            return name
+    return None
+
+
+def bucket(ts, interval):
+    width = INTERVALS[interval]
+    if width is not None:
+        start = ts - ts % width
+        return start, start + width
+    d = datetime.fromtimestamp(ts / 1000).date()
+    start = _day_start(d)
+    return start, _day_start(d + timedelta(days=1))
+
+
+def resample(bars, interval, now=None):
+    '''Complete bars of interval from finer bars, oldest first'''
+    out = []
+    end = None
+    for b in bars:
+        ts = int(b['timestamp'])
+        if end is None or ts >= end:
+            start, end = bucket(ts, interval)
+            cur = {'timestamp': start, 'open': b['open'], 'high': b['high'],
+                   'low': b['low'], 'close': b['close'], 'volume': b.get('volume') or 0}
+            out.append((end, cur))
+        else:
+            cur['high'] = max(cur['high'], b['high'])
+            cur['low'] = min(cur['low'], b['low'])
+            cur['close'] = b['close']
+            cur['volume'] += b.get('volume') or 0
+    now = now or int(time() * 1000)
+    return [bar for bar_end, bar in out if bar_end <= now]
+
+
+class BarSeries:
+    '''
+    Closed bars of one instrument and interval in a ring buffer plus the
+    bar that is still forming. Ticks inside the current bucket only touch
+    the forming bar, the first tick past its end closes it.
+    '''
+    __slots__ = ('symbol', 'interval', 'bars', 'bar', 'end', 'vtt')
+
+    def __init__(self, symbol, interval, size=BAR_HISTORY):
+        self.symbol = symbol
+        self.interval = interval
+        self.bars = deque(maxlen=size)
+        self.bar = None
+        self.end = 0
+        self.vtt = None
+
+    def update(self, ts, ltp, vtt=None):
+        closed = None
+        bar = self.bar
+        if bar is not None and ts >= self.end:
+            closed = self._close()
+            bar = None
+        if bar is None:
+            start, self.end = bucket(ts, self.interval)
+            bar = self.bar = {'symbol': self.symbol, 'interval': self.interval,
+                              'timestamp': start, 'open': ltp, 'high': ltp,
+                              'low': ltp, 'close': ltp, 'volume': 0}
+        else:
+            if ltp > bar['high']:
+                bar['high'] = ltp
+            elif ltp < bar['low']:
+                bar['low'] = ltp
+            bar['close'] = ltp
+        if vtt is not None:
+            # vtt is the day's cumulative volume, a bar gets the increase
+            if self.vtt is not None and vtt >= self.vtt:
+                bar['volume'] += vtt - self.vtt
+            self.vtt = vtt
+        return closed
+
+    def expire(self, now):
+        if self.bar is not None and now >= self.end:
+            return self._close()
+        return None
+
+    def seed(self, bars):
+        last = self.bars[-1]['timestamp'] if self.bars else -1
+        for b in bars:
+            ts = int(b['timestamp'])
+            if ts <= last or (self.bar is not None and ts >= self.bar['timestamp']):
+                continue
+            bar = dict(b, symbol=self.symbol, interval=self.interval, timestamp=ts)
+            self.bars.append(bar)
+            last = ts
+
+    def _close(self):
+        bar = self.bar
+        self.bars.append(bar)
+        self.bar = None
+        return bar
+
+
+class BarAggregator:
+    '''
+    Builds OHLCV bars for tracked instruments from every tick, before
+    quotes are conflated, and hands each closed bar to on_close. Bars of
+    quiet instruments are closed by expire() once their end has passed.
+    '''
+    def __init__(self, on_close, size=BAR_HISTORY):
+        self.logger = create_logger(self.__class__.__name__)
+        self.on_close = on_close
+        self.size = size
+        self.series = {}
+        self.lock = Lock()
+
+    def track(self, symbol, intervals):
+        '''Returns the intervals that were not tracked before'''
+        added = []
+        with self.lock:
+            series = self.series.get(symbol, ())
+            known = set(s.interval for s in series)
+            for interval in intervals:
+                if interval not in INTERVALS:
+                    raise ValueError('Unknown bar interval %s' % interval)
+                if interval not in known:
+                    series += (BarSeries(symbol, interval, self.size),)
+                    known.add(interval)
+                    added.append(interval)
+            self.series[symbol] = series
+        return added
+
+    def update(self, tick):
+        series = self.series.get(tick.symbol)
+        if series is None:
+            return
+        ts = tick.timestamp or int(time() * 1000)
+        ltp = float(tick.ltp)
+        vtt = tick.get('vtt')
+        vtt = int(vtt) if vtt else None
+        closed = []
+        with self.lock:
+            for s in series:
+                bar = s.update(ts, ltp, vtt)
+                if bar is not None:
+                    closed.append(bar)
+        for bar in closed:
+            self.on_close(bar)
+
+    def expire(self, now=None, force=False):
+        '''Closes forming bars whose end has passed, or all of them when forced'''
+        if now is None:
+            now = int(time() * 1000) - BAR_GRACE
+        closed = []
+        with self.lock:
+            for series in self.series.values():
+                for s in series:
+                    bar = s.expire(now) if not force else s.expire(s.end)
+                    if bar is not None:
+                        closed.append(bar)
+        for bar in closed:
+            self.on_close(bar)
+        return len(closed)
+
+    def bars(self, symbol, interval):
+        '''Closed bars, cached history first, oldest first'''
+        for s in self.series.get(symbol, ()):
+            if s.interval == interval:
+                with self.lock:
+                    return list(s.bars)
+        return []
+
+    def current(self, symbol, interval):
+        for s in self.series.get(symbol, ()):
+            if s.interval == interval:
+                return s.bar
+        return None
+
+    def load_history(self, client, store, instrument, interval, days):
+        '''
+        Seeds the ring with complete bars from OHLCStore so live bars carry
+        straight on from cached ones. Returns the bars that were added.
+        '''
+        symbol = instrument.symbol.lower()
+        todt = date.today()
+        fromdt = todt - timedelta(days=days)
+        bars = store.get(client, instrument, HISTORY_INTERVALS[interval], fromdt, todt)
+        bars = resample(bars, interval)
+        for s in self.series.get(symbol, ()):
+            if s.interval == interval:
+                with self.lock:
+                    before = len(s.bars)
+                    s.seed(bars)
+                    added = len(s.bars) - before
+                self.logger.debug('Seeded %d %s bars for %s' % (added, interval, symbol))
+                return list(s.bars)[-added:] if added else []
+        return []
+
+
+def _day_start(d):
+    return int(datetime(d.year, d.month, d.day).timestamp() * 1000)
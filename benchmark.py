@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import platform
+import random
+import subprocess
+import tempfile
+from datetime import datetime
+from time import perf_counter
+import indicators
+from metrics import Histogram
+
+RESULTS_DIR = 'bench_results'
+CONFIG = os.path.join(RESULTS_DIR, 'benchmark.ini')
+QUIET = ('GannBot', 'GannNiftyOptions', 'Manager', 'EMATS', 'OptionChain', 'MockUpstox',
+         'SessionPool', 'OrderGateway', 'FeedSupervisor', 'RiskEngine', 'BarAggregator')
+SYMBOL_COUNTS = (2, 20, 200)
+STRATEGY_COUNTS = (1, 10, 50)
+TICKS = 20000
+
+
+def synthetic_ohlc(bars, start=10000.0, seed=0):
+    rnd = random.Random(seed)
+    price = start
+    out = []
+    for i in range(bars):
+        o = price
+        c = max(o + rnd.gauss(0, o * 0.01), 1.0)
+        out.append({'timestamp': i * 86400000, 'open': o, 'high': max(o, c),
+                    'low': min(o, c), 'close': c})
+        price = c
+    return out
+
+
+def timed(fn, *args, **kwargs):
+    start = perf_counter()
+    result = fn(*args, **kwargs)
+    return perf_counter() - start, result
+
+
+def bench_indicators(symbols=200, bars=250, n=5):
+    '''
+    Scalar indicators.ema/sma/gann evaluated bar by bar for every symbol
+    against one batch call into vindicators, results must match exactly.
+    '''
+    import numpy as np
+    import vindicators
+
+    universe = [synthetic_ohlc(bars, seed=s) for s in range(symbols)]
+    results = {}
+
+    def scalar_ema():
+        return [[indicators.ema(u[:i + 1], n=n, seed=None) for i in range(bars)]
+                for u in universe]
+
+    def vector_ema():
+        close = vindicators.stack([vindicators.closes(u) for u in universe])
+        return vindicators.ema(close, n=n, seed=None)
+
+    ts, scalar = timed(scalar_ema)
+    tv, vector = timed(vector_ema)
+    expected = np.array([[np.nan if v is None else v for v in row] for row in scalar])
+    results['ema'] = {'scalar_s': ts, 'vector_s': tv, 'speedup': ts / tv,
+                      'identical': bool(np.array_equal(expected, vector, equal_nan=True))}
+
+    def scalar_sma():
+        return [[indicators.sma(u[i - n + 1:i + 1]) for i in range(n - 1, bars)]
+                for u in universe]
+
+    def vector_sma():
+        close = vindicators.stack([vindicators.closes(u) for u in universe])
+        return vindicators.sma(close, n)[:, n - 1:]
+
+    ts, scalar = timed(scalar_sma)
+    tv, vector = timed(vector_sma)
+    results['sma'] = {'scalar_s': ts, 'vector_s': tv, 'speedup': ts / tv,
+                      'identical': bool(np.array_equal(np.array(scalar), vector))}
+
+    prices = [float(u[-1]['close']) for u in universe] * max(bars // 10, 1)
+
+    def scalar_gann():
+        return [(indicators.gann(p), indicators.gann(p, 'down')) for p in prices]
+
+    def vector_gann():
+        return vindicators.gann_grid(np.array(prices))
+
+    ts, scalar = timed(scalar_gann)
+    tv, (up, down) = timed(vector_gann)
+    same = (np.array_equal(np.array([s[0] for s in scalar]), up) and
+            np.array_equal(np.array([s[1] for s in scalar]), down))
+    results['gann'] = {'scalar_s': ts, 'vector_s': tv, 'speedup': ts / tv,
+                       'identical': bool(same)}
+    return results
+
+
+def bench_scalar_indicators(calls=20000, n=5):
+    bars = synthetic_ohlc(n + 20)
+    prices = [float(b['close']) for b in bars]
+    out = {}
+    t, _ = timed(lambda: [indicators.ema(bars, n=n, seed=None) for i in range(calls)])
+    out['ema_us'] = t / calls * 1e6
+    t, _ = timed(lambda: [indicators.gann(prices[i % len(prices)]) for i in range(calls)])
+    out['gann_us'] = t / calls * 1e6
+    levels = indicators.GannLevels()
+    t, _ = timed(lambda: [levels.get(prices[i % len(prices)]) for i in range(calls)])
+    out['gann_levels_us'] = t / calls * 1e6
+    return out
+
+
+def bench_emats(bars=250, repeat=5):
+    from mockupstox import MockUpstox
+    from ohlcstore import OHLCStore
+    from emats import EMATS
+    client = MockUpstox.with_nifty_chain()
+    store = OHLCStore(':memory:')
+    # a fresh instance per repeat, setup on a used one feeds its bars twice
+    bots = [EMATS(store=store) for i in range(repeat)]
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # setup dumps nifty_ohlc_sample.csv into the working directory
+        os.chdir(tmp)
+        try:
+            setup = min(timed(e.setup, client)[0] for e in bots)
+        finally:
+            os.chdir(cwd)
+    series = synthetic_ohlc(bars)
+    on_bar = min(timed(lambda e: [e.on_bar(b) for b in series], EMATS(store=store))[0]
+                 for i in range(repeat))
+    return {'setup_s': setup, 'on_bar_us': on_bar / bars * 1e6}
+
+
+def _pipeline(symbols, strategies):
+    from manager import Manager
+    from mockupstox import MockUpstox
+    from niftyoptions import GannNiftyOptions
+    from models import State
+    from upstox_api import api as upstox
+
+    client = MockUpstox.with_nifty_chain(strikes=max(symbols // 4, 1))
+    insts = list(upstox.master_contracts_by_symbol['nse_fo'].values())
+    ces = [i for i in insts if i.symbol.endswith('CE')][:max(symbols // 2, 1)]
+    pes = [i for i in insts if i.symbol.endswith('PE')][:max(symbols // 2, 1)]
+    if not os.path.exists(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    m = Manager(CONFIG)
+    m.attach_client(client, use_cache=False)
+    for k in range(strategies):
+        o = GannNiftyOptions()
+        o.ce_symbol = ces[k % len(ces)].symbol.lower()
+        o.pe_symbol = pes[k % len(pes)].symbol.lower()
+        o.state |= State.SETUP
+        m.add_strategy(o)
+    return m, client, ces + pes
+
+
+def bench_pipeline(symbols, strategies, ticks=TICKS, seed=0):
+    '''
+    Synthetic quotes through Manager.quote_handler and the main loop
+    dispatch into GannNiftyOptions/GannBot.process_quote, one tick at a
+    time so each sample is the full handler to decision path.
+    '''
+    m, client, insts = _pipeline(symbols, strategies)
+    rnd = random.Random(seed)
+    prices = {i.symbol: i.closing_price for i in insts}
+    stream = []
+    for n in range(ticks):
+        inst = insts[n % len(insts)]
+        p = max(round((prices[inst.symbol] + rnd.gauss(0, 0.1)) / 0.05) * 0.05, 0.05)
+        prices[inst.symbol] = p
+        stream.append({'timestamp': n, 'exchange': inst.exchange, 'symbol': inst.symbol,
+                       'instrument': inst, 'ltp': p})
+    hist = Histogram()
+    start = perf_counter()
+    for q in stream:
+        t = perf_counter()
+        m.quote_handler(q)
+        m._process_quotes()
+        hist.record(perf_counter() - t)
+    total = perf_counter() - start
+    p = hist.percentiles((50, 99))
+    return {'symbols': len(insts), 'strategies': strategies, 'ticks': ticks,
+            'ticks_per_s': ticks / total, 'p50_us': p[50] * 1e6, 'p99_us': p[99] * 1e6}
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except Exception as e:
+        commit = 'unknown'
+    return {'commit': commit, 'python': sys.version.split()[0],
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'time': datetime.now().isoformat()}
+
+
+def run_suite(symbol_counts=SYMBOL_COUNTS, strategy_counts=STRATEGY_COUNTS,
+              ticks=TICKS, vector=True):
+    for name in QUIET:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    results = {'environment': environment(),
+               'scalar_indicators': bench_scalar_indicators(),
+               'emats': bench_emats(),
+               'pipeline': [bench_pipeline(n, s, ticks)
+                            for n in symbol_counts for s in strategy_counts]}
+    if vector:
+        try:
+            results['indicators'] = bench_indicators()
+        except ImportError:
+            pass
+    return results
+
+
+def save(results, directory=RESULTS_DIR):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    env = results['environment']
+    name = '%s-%s.json' % (env['commit'], datetime.now().strftime('%Y%m%d-%H%M%S'))
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def compare(old, new):
+    '''Ratios new/old for every pipeline cell, above 1 is slower for latencies'''
+    rows = []
+    before = {(r['symbols'], r['strategies']): r for r in old['pipeline']}
+    for r in new['pipeline']:
+        o = before.get((r['symbols'], r['strategies']))
+        if o is None:
+            continue
+        rows.append((r['symbols'], r['strategies'],
+                     r['ticks_per_s'] / o['ticks_per_s'],
+                     r['p99_us'] / o['p99_us']))
+    return rows
+
+
+def report(results):
+    print('commit %(commit)s | python %(python)s | %(cpus)s cpus' % results['environment'])
+    for name, value in results['scalar_indicators'].items():
+        print('%-16s %.2f us/call' % (name, value))
+    print('emats setup %.4fs | on_bar %.2f us' %
+          (results['emats']['setup_s'], results['emats']['on_bar_us']))
+    for r in results['pipeline']:
+        print('%4d symbols %3d strategies | %9.0f ticks/s | p50 %7.1f us | p99 %7.1f us' %
+              (r['symbols'], r['strategies'], r['ticks_per_s'], r['p50_us'], r['p99_us']))
+    for name, r in results.get('indicators', {}).items():
+        print('%-5s scalar %.4fs | vector %.4fs | %.1fx | identical %s' %
+              (name, r['scalar_s'], r['vector_s'], r['speedup'], r['identical']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tick pipeline and indicator benchmarks')
+    parser.add_argument('--ticks', type=int, default=TICKS)
+    parser.add_argument('--symbols', type=int, nargs='+', default=SYMBOL_COUNTS)
+    parser.add_argument('--strategies', type=int, nargs='+', default=STRATEGY_COUNTS)
+    parser.add_argument('--no-vector', action='store_true', help='skip the numpy comparison')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+    results = run_suite(args.symbols, args.strategies, args.ticks, not args.no_vector)
+    report(results)
+    print('Saved %s' % save(results))
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        for sym, strat, tput, p99 in compare(old, results):
+            print('%4d symbols %3d strategies | throughput x%.2f | p99 x%.2f' % (sym, strat, tput, p99))
@@ -1,5 +1,5 @@
 from threading import Thread
-from time import sleep
+from queue import Empty
 
 FREQ = 5.0
 
@@ -17,16 +17,17 @@ class TradeBot(Thread):
     def run(self):
         self.running = True
         while self.running:
-            while not self.messages.empty():
-                m = self.messages.get()
-                if m[0] == 'q':
-                    self.process_quote(m[1])
-                elif m[0] == 'o':
-                    self.process_order(m[1])
-                else:
-                    self.process_trade(m[1])
-                self.messages.task_done()
-            sleep(1 / FREQ)
+            try:
+                m = self.messages.get(timeout=1 / FREQ)
+            except Empty:
+                continue
+            if m[0] == 'q':
+                self.process_quote(m[1])
+            elif m[0] == 'o':
+                self.process_order(m[1])
+            else:
+                self.process_trade(m[1])
+            self.messages.task_done()
 
     def process_quote(self, message):
         pass
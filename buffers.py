@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from queue import Queue, Empty, Full
+from threading import Lock
+
+BLOCK = 'block'
+RAISE = 'raise'
+
+
+class ConflatingQueue:
+    '''
+    Holds only the latest item per key. A key keeps its place in line
+    from when it first became pending, a newer item for it just replaces
+    the waiting one and counts as collapsed. Size is bounded by the
+    number of distinct keys.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = OrderedDict()
+        self.collapsed = 0
+
+    def put(self, key, item):
+        with self.lock:
+            if key in self.pending:
+                self.collapsed += 1
+            self.pending[key] = item
+
+    def get_nowait(self):
+        with self.lock:
+            if not self.pending:
+                raise Empty
+            return self.pending.popitem(last=False)[1]
+
+    def qsize(self):
+        return len(self.pending)
+
+    def empty(self):
+        return not self.pending
+
+
+class BoundedQueue(Queue):
+    '''
+    Lossless queue with a size limit. When full, offer() either blocks
+    the producer until there is room (BLOCK, optionally up to timeout)
+    or raises queue.Full straight away (RAISE). Every full hit is
+    counted in stalls.
+    '''
+    def __init__(self, maxsize, policy=BLOCK, timeout=None):
+        super().__init__(maxsize)
+        self.policy = policy
+        self.timeout = timeout
+        self.stalls = 0
+
+    def offer(self, item):
+        try:
+            self.put_nowait(item)
+        except Full:
+            self.stalls += 1
+            if self.policy == RAISE:
+                raise
+            self.put(item, timeout=self.timeout)
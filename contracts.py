@@ -0,0 +1,152 @@
+import os
+import sqlite3
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from threading import Lock
+from upstox_api import api as upstox
+from utils import create_logger
+
+CACHE_DIR = 'cache'
+CONTRACTS_DB = 'contracts.db'
+PUBLISH_HOUR = 8
+FIELDS = upstox.Instrument._fields
+
+
+def current_version(now=None):
+    '''Master contracts are republished each morning, earlier than that the previous day's file is current'''
+    now = now or datetime.now()
+    if now.hour < PUBLISH_HOUR:
+        now = now - timedelta(days=1)
+    return now.strftime('%Y-%m-%d')
+
+
+class ContractStore:
+    '''
+    sqlite backed master contract cache, one versioned copy per exchange
+    with indexes on symbol and token so single lookups never load the
+    whole contract.
+    '''
+    def __init__(self, path=None):
+        self.logger = create_logger(self.__class__.__name__)
+        if path is None:
+            if not os.path.exists(CACHE_DIR):
+                os.makedirs(CACHE_DIR)
+            path = os.path.join(CACHE_DIR, CONTRACTS_DB)
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        columns = ', '.join(FIELDS)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS instruments (%s, '
+                            'PRIMARY KEY (exchange, token))' % columns)
+            self.db.execute('CREATE INDEX IF NOT EXISTS instruments_symbol '
+                            'ON instruments (exchange, lower(symbol))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS versions '
+                            '(exchange PRIMARY KEY, version, count)')
+
+    def version(self, exchange):
+        with self.lock:
+            row = self.db.execute('SELECT version FROM versions WHERE exchange = ?',
+                                  (exchange,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, exchange, contracts, version):
+        rows = [tuple(inst) for inst in contracts.values()]
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM instruments WHERE exchange = ?', (exchange,))
+            self.db.executemany('INSERT OR REPLACE INTO instruments VALUES (%s)' %
+                                ', '.join('?' * len(FIELDS)), rows)
+            self.db.execute('INSERT OR REPLACE INTO versions VALUES (?, ?, ?)',
+                            (exchange, version, len(rows)))
+        self.logger.info('Cached %d %s contracts for %s' % (len(rows), exchange, version))
+
+    def get(self, exchange, key, value):
+        with self.lock:
+            row = self.db.execute('SELECT * FROM instruments WHERE exchange = ? AND %s = ?' % key,
+                                  (exchange, value)).fetchone()
+        return upstox.Instrument(*row) if row else None
+
+    def keys(self, exchange, key):
+        with self.lock:
+            rows = self.db.execute('SELECT %s FROM instruments WHERE exchange = ?' % key,
+                                   (exchange,)).fetchall()
+        return [r[0] for r in rows]
+
+    def instruments(self, exchange):
+        with self.lock:
+            rows = self.db.execute('SELECT * FROM instruments WHERE exchange = ?',
+                                   (exchange,)).fetchall()
+        return [upstox.Instrument(*row) for row in rows]
+
+    def count(self, exchange):
+        with self.lock:
+            row = self.db.execute('SELECT count FROM versions WHERE exchange = ?',
+                                  (exchange,)).fetchone()
+        return row[0] if row else 0
+
+
+class LazyContracts(Mapping):
+    '''
+    Stands in for the upstox client's per-exchange symbol or token dict.
+    Instruments are read from the store on first use and kept in memory.
+    '''
+    def __init__(self, store, exchange, key='symbol'):
+        self.store = store
+        self.exchange = exchange
+        self.key = key
+        self.loaded = {}
+
+    def __getitem__(self, value):
+        inst = self.loaded.get(value)
+        if inst is None:
+            if self.key == 'symbol':
+                inst = self.store.get(self.exchange, 'lower(symbol)', value.lower())
+            else:
+                inst = self.store.get(self.exchange, 'token', int(value))
+            if inst is None:
+                raise KeyError(value)
+            self.loaded[value] = inst
+        return inst
+
+    def __contains__(self, value):
+        try:
+            self[value]
+        except (KeyError, ValueError):
+            return False
+        return True
+
+    def __iter__(self):
+        keys = self.store.keys(self.exchange, self.key)
+        if self.key == 'symbol':
+            keys = [k.lower() for k in keys]
+        return iter(keys)
+
+    def __len__(self):
+        return self.store.count(self.exchange)
+
+    def values(self):
+        # one query for the whole exchange instead of one per key
+        insts = self.store.instruments(self.exchange)
+        for inst in insts:
+            key = inst.symbol.lower() if self.key == 'symbol' else inst.token
+            self.loaded.setdefault(key, inst)
+        return insts
+
+
+def load_master_contract(client, exchange, store):
+    '''
+    Points upstox_api's module level contract dicts, which every client
+    reads instruments from, at the store. A stale store is refreshed from
+    the api first.
+    '''
+    version = current_version()
+    if store.version(exchange) != version:
+        # get_master_contract returns whatever is already loaded instead of downloading
+        upstox.master_contracts_by_token.pop(exchange, None)
+        upstox.master_contracts_by_symbol.pop(exchange, None)
+        contracts = client.get_master_contract(exchange)
+        if not contracts:
+            return contracts
+        store.save(exchange, contracts, version)
+    upstox.master_contracts_by_symbol[exchange] = LazyContracts(store, exchange, 'symbol')
+    upstox.master_contracts_by_token[exchange] = LazyContracts(store, exchange, 'token')
+    return upstox.master_contracts_by_symbol[exchange]
@@ -1,10 +1,11 @@
 from upstox_api import api as upstox
 from datetime import datetime, timedelta
-from itertools import groupby
 from logging import DEBUG
 from utils import create_logger, ts_to_datetime
 from collections import namedtuple
-from indicators import ema
+from streaming import Crossover as EMACrossover, crossover
+from ohlcstore import OHLCStore
+from models import State
 
 N50_SYMBOL = 'NIFTY_50'
 LOT_SIZE = 75
@@ -16,14 +17,28 @@ Crossover = namedtuple('Crossover', ['direction', 'date', 'instrument'])
 
 
 class EMATS:
-    def __init__(self, debug=False):
+    '''
+    Daily FAST_EMA/SLOW_EMA crossover on NIFTY 50. The averages are
+    running EMAs over all history (streaming.Crossover), not the short
+    windowed indicators.ema(seed=None) values recomputed per bar that
+    EMATS used before, so crossover dates can differ from older runs.
+    '''
+    bar_intervals = ('day',)
+
+    def __init__(self, debug=False, store=None, fast=FAST_EMA, slow=SLOW_EMA):
         if debug:
             self.logger = create_logger(self.__class__.__name__,
                                         console=True, level=DEBUG)
         else:
             self.logger = create_logger(self.__class__.__name__, console=False)
 
-        self.state = []
+        self.state = State.INITIALISED
+        self.store = store
+        self.instrument = None
+        self.fast = fast
+        self.slow = slow
+        self.crossover = EMACrossover(fast, slow)
+        self.forming = None
         self.logger.debug('')
         self.logger.debug('Initialised class')
 
@@ -47,32 +62,62 @@ class EMATS:
                        'close': ohlc['close']}
                 writer.writerow(row)
 
-        for i, ohlc in enumerate(ohlc_arr):
-            if i <= SLOW_EMA + 1:
-                continue
-            ema_3 = []
-            ema_5 = []
-            ema_3 = (ema(ohlc_arr[i - FAST_EMA - 2:i - 1], n=FAST_EMA, seed=None),
-                     ema(ohlc_arr[i - FAST_EMA - 1:i], n=FAST_EMA, seed=None))
-            ema_5 = (ema(ohlc_arr[i - SLOW_EMA - 2:i - 1:], n=SLOW_EMA, seed=None),
-                     ema(ohlc_arr[i - SLOW_EMA - 1:i], n=SLOW_EMA, seed=None))
-            cross = self._check_crossover(ema_3, ema_5)
+        self.instrument = nifty
+        for ohlc in ohlc_arr:
+            self.on_bar(ohlc)
+        self.state |= State.SETUP
+
+    def on_bar(self, ohlc):
+        cross = self.crossover.update(float(ohlc['close']))
+        if cross is not None:
+            d = ts_to_datetime(ohlc['timestamp']).date()
+            self.logger.debug('Crossover on %s. Direction = %s' %
+                              (d.strftime('%d-%m-%Y'), cross))
+            self.logger.debug('%d EMA = %.2f | %d EMA = %.2f' %
+                              (self.fast, self.crossover.fast.value,
+                               self.slow, self.crossover.slow.value))
+            self.logger.debug('-------------------------------\n')
+        return cross
+
+    def process_quote(self, quote):
+        cross = self.crossover.peek(quote['ltp'])
+        if cross != self.forming:
+            self.forming = cross
             if cross is not None:
-                d = ts_to_datetime(ohlc['timestamp']).date()
-                self.logger.debug('Crossover on %s. Direction = %s' %
-                                  (d.strftime('%d-%m-%Y'), cross))
-                self.logger.debug('3 EMAs = %.2f | %.2f' % (ema_3[0], ema_3[1]))
-                self.logger.debug('5 EMAs = %.2f | %.2f' % (ema_5[0], ema_5[1]))
-                self.logger.debug('-------------------------------\n')
+                self.logger.debug('Crossover forming at %.2f. Direction = %s' %
+                                  (quote['ltp'], cross))
+
+    def process_order(self, order):
+        pass
+
+    def process_trade(self, trade):
+        pass
 
+    def get_symbols(self):
+        if not self.state & State.SETUP:
+            return None
+        return self.instrument.symbol.lower()
+
+    def snapshot(self):
+        inst = self.instrument
+        return {'state': int(self.state),
+                'instrument': (inst.exchange, inst.symbol) if inst is not None else None,
+                'crossover': self.crossover.snapshot(),
+                'forming': self.forming}
+
+    def restore(self, state, client=None):
+        if state['instrument'] is not None:
+            self.instrument = client.get_instrument_by_symbol(*state['instrument'])
+        self.crossover.restore(state['crossover'])
+        self.forming = state['forming']
+        self.state = State(state['state'])
 
     def _get_ohlc(self, client, instrument, fromdt, todt):
         self.logger.debug('Retrieving daily ohlc data for period %s to %s' %
                           (fromdt.strftime('%d-%m-%Y'), todt.strftime('%d-%m-%Y')))
-        data = client.get_ohlc(instrument, upstox.OHLCInterval.Day_1, fromdt, todt)
-        self.logger.debug('Total records  = %d' % len(data))
-        data = sorted(data[:], key=lambda k: k['timestamp'])
-        ohlc = [list(g)[0] for k, g in groupby(data, key=lambda k: k['timestamp'])]
+        if self.store is None:
+            self.store = OHLCStore()
+        ohlc = self.store.get(client, instrument, upstox.OHLCInterval.Day_1, fromdt, todt)
         self.logger.debug('Unique records = %d' % len(ohlc))
         return ohlc
 
@@ -81,10 +126,5 @@ class EMATS:
             return None
         if len(fast_ma) < 2 or len(slow_ma) < 2:
             return None
-        if fast_ma[0] < slow_ma[0] and fast_ma[1] > slow_ma[1]:
-            return 'up'
-        elif fast_ma[0] > slow_ma[0] and fast_ma[1] < slow_ma[1]:
-            return 'down'
-        else:
-            return None
+        return crossover(fast_ma[0], fast_ma[1], slow_ma[0], slow_ma[1])
 
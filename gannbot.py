@@ -1,16 +1,18 @@
 from bot import LinearBot
 from upstox_api import api as upstox
-from indicators import gann
-from utils import BUY, SELL, round_off
-from datetime import datetime
+from indicators import GannLevels
+from models import State, OrderIntent, PositionState, entry_order
+from utils import BUY, SELL, round_off, create_logger
 
 DEFAULTS = {'buy': 4, 'target': -1, 'stoploss': 5}
 LOT_SIZE = 75
+TICK_SIZE = 0.05
 
 
 class GannBot(LinearBot):
-    def __init__(self, balance=15000, debug=False):
+    def __init__(self, balance=15000, debug=False, params=None):
         super().__init__()
+        self.logger = create_logger(self.__class__.__name__, console=True)
 
         self.running = False
         self.messages = None
@@ -19,22 +21,19 @@ class GannBot(LinearBot):
         self.target = 0
         self.stoploss = 0
         self.prev_ltp = 0
+        self.params = dict(DEFAULTS, **(params or {}))
+        self.levels = GannLevels(self.params['buy'], self.params['target'],
+                                 self.params['stoploss'], TICK_SIZE)
 
         self.balance = balance
-        self.state = []
-        self.holdings = 0
+        self.position = PositionState()
         self.uptrend = True
         self.instrument = None
 
-        self.oid = None
-        self.poid = None
-
-        self.state.append('Initialised')
-
     def process_quote(self, quote):
         ltp = quote['ltp']
         act = None
-        if 'setup complete' not in self.state:
+        if not self.position.flags & State.SETUP:
             self._setup(quote)
             return act
 
@@ -42,24 +41,23 @@ class GannBot(LinearBot):
             self.uptrend = False
             return act
 
-        if 'order placed' == self.state[-1]:
+        if self.position.flags & State.ORDER_PLACED:
             return act
         elif ltp > self.buy:
             act = self._create_buy_order()
-            self.state.append('order placed')
+            self.position.ordered()
         elif ltp < self.prev_ltp:
-            levels = gann(ltp)
-            self.buy = levels[DEFAULTS['buy']]
-            self.target = levels[DEFAULTS['target']]
-            self.stoploss = gann(ltp, 'down')[DEFAULTS['stoploss']]
+            levels = self.levels.get(ltp)
+            if levels != (self.buy, self.target, self.stoploss):
+                self.buy, self.target, self.stoploss = levels
+                self._print_levels()
             self.prev_ltp = ltp
-            self._print_levels()
         return act
 
     def process_order(self, order):
         status = order['status'].lower()
         if status == 'rejected':
-            self.state.append('last order rejected')
+            self.position.rejected()
 
     def process_trade(self, trade):
         status = str(trade['message'])
@@ -72,47 +70,55 @@ class GannBot(LinearBot):
 
         if status in ('completed', 'complete'):
             if tt == BUY:
-                self.holdings += qty
+                self.position.bought(qty, oid)
             elif tt == SELL:
-                self.holdings -= qty
-                if self.holdings < 1:
-                    self.status.append('position closed')
-            self.poid = oid
-            self.status.append('position open')
+                self.position.sold(qty, oid)
 
     def get_symbols(self):
-        if 'setup complete' not in self.state:
+        if not self.position.flags & State.SETUP:
             return None
-        else:
-            return self.instrument.symbol.lower()
+        return self.instrument.symbol.lower()
+
+    def snapshot(self):
+        inst = self.instrument
+        return {'instrument': (inst.exchange, inst.symbol) if inst is not None else None,
+                'levels': (self.buy, self.target, self.stoploss),
+                'prev_ltp': self.prev_ltp,
+                'uptrend': self.uptrend,
+                'position': self.position.snapshot()}
+
+    def restore(self, state, client=None):
+        if state['instrument'] is not None:
+            self.instrument = client.get_instrument_by_symbol(*state['instrument'])
+        self.buy, self.target, self.stoploss = state['levels']
+        self.prev_ltp = state['prev_ltp']
+        self.uptrend = state['uptrend']
+        self.position.restore(state['position'])
+
+    def reconcile(self, positions, orders):
+        if self.instrument is None:
+            return False
+        sym = self.instrument.symbol.lower()
+        return self.position.reconcile(positions.get(sym, 0), entry_order(orders, sym))
 
     def _setup(self, ltp_quote):
         self.instrument = ltp_quote['instrument']
         ltp = ltp_quote['ltp']
-        levels = gann(ltp)
-        self.buy = levels[DEFAULTS['buy']]
-        self.target = levels[DEFAULTS['target']]
-        self.stoploss = gann(ltp, 'down')[DEFAULTS['stoploss']]
+        self.buy, self.target, self.stoploss = self.levels.get(ltp)
         self.prev_ltp = ltp
         self._print_levels()
-        self.state.append('setup complete')
+        self.position.flags |= State.SETUP
 
     def _create_buy_order(self):
-        order = {'transaction': upstox.TransactionType.Buy,
-                 'instrument': self.instrument,
-                 'quantity': int(round_off(self.balance / self.buy, LOT_SIZE)),
-                 'order_type': upstox.OrderType.Limit,
-                 'product': upstox.ProductType.OneCancelsOther,
-                 'buy_price': self.buy,
-                 'stoploss': abs(self.buy - self.stoploss),
-                 'target': abs(self.target - self.buy)}
-        return order
+        return OrderIntent(upstox.TransactionType.Buy,
+                           self.instrument,
+                           int(round_off(self.balance / self.buy, LOT_SIZE)),
+                           upstox.OrderType.Limit,
+                           upstox.ProductType.OneCancelsOther,
+                           self.buy,
+                           stoploss=abs(self.buy - self.stoploss),
+                           target=abs(self.target - self.buy))
 
     def _print_levels(self):
-        print('\n--------')
-        print(datetime.now().isoformat())
-        print('Calculated values for %s - ' % self.instrument.symbol)
-        print('\tBuy   - %f' % self.buy)
-        print('\tSell  - %f' % self.target)
-        print('\tSL    - %f' % self.stoploss)
-        print('--------')
+        self.logger.info('Calculated values for %s - Buy %f | Sell %f | SL %f',
+                         self.instrument.symbol, self.buy, self.target, self.stoploss)
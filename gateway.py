@@ -0,0 +1,104 @@
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+from upstox_api import api
+from utils import create_logger
+
+WORKERS = 4
+STOP_TIMEOUT = 5
+
+
+class OrderGateway:
+    '''
+    Sends order dicts produced by strategies to the broker on a pool of
+    worker threads. Orders are sharded by symbol so every instrument keeps
+    its submission order while different instruments go out concurrently.
+    Each result is handed to on_ack as an order update dict.
+    '''
+    def __init__(self, on_ack, workers=WORKERS, account=None):
+        self.logger = create_logger(self.__class__.__name__)
+        self.client = None
+        self.on_ack = on_ack
+        self.account = account
+        self.lanes = [Queue() for _ in range(workers)]
+        self.threads = []
+        self.running = False
+
+    def start(self, client):
+        if self.running:
+            return
+        self.client = client
+        self.running = True
+        for i, lane in enumerate(self.lanes):
+            t = Thread(target=self._worker, args=(lane,),
+                       name='order-gateway-%d' % i, daemon=True)
+            t.start()
+            self.threads.append(t)
+        self.logger.debug('Started %d order lanes' % len(self.lanes))
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        for lane in self.lanes:
+            lane.put(None)
+        for t in self.threads:
+            t.join(STOP_TIMEOUT)
+        self.threads = []
+
+    def submit(self, order):
+        lane = self.lanes[hash(order['instrument'].symbol) % len(self.lanes)]
+        lane.put((perf_counter(), order))
+
+    def pending(self):
+        return sum(lane.qsize() for lane in self.lanes)
+
+    def _worker(self, lane):
+        while True:
+            item = lane.get()
+            if item is None:
+                return
+            submitted, order = item
+            inst = order['instrument']
+            ack = {'symbol': inst.symbol,
+                   'instrument': inst,
+                   'exchange': inst.exchange,
+                   'transaction_type': order['transaction'].value,
+                   'quantity': order['quantity'],
+                   'price': order['buy_price'],
+                   'order_id': 'NA',
+                   'gateway': True}
+            if self.account is not None:
+                ack['account'] = self.account
+            try:
+                response = self._send(order)
+                ack['status'] = 'placed'
+                ack['message'] = ''
+                if isinstance(response, dict) and 'order_id' in response:
+                    ack['order_id'] = str(response['order_id'])
+            except Exception as e:
+                self.logger.exception('Order for %s failed' % inst.symbol)
+                ack['status'] = 'rejected'
+                ack['message'] = str(e)
+            ack['latency'] = perf_counter() - submitted
+            self.logger.debug('%s order for %s %s in %.1fms' %
+                              (ack['transaction_type'], inst.symbol, ack['status'],
+                               ack['latency'] * 1000))
+            try:
+                self.on_ack(ack)
+            except Exception as e:
+                self.logger.exception('Order acknowledgement handler failed')
+
+    def _send(self, order):
+        return self.client.place_order(order['transaction'],
+                                       order['instrument'],
+                                       order['quantity'],
+                                       order['order_type'],
+                                       order['product'],
+                                       order['buy_price'],
+                                       None,
+                                       0,
+                                       api.DurationType.DAY,
+                                       order['stoploss'],
+                                       order['target'],
+                                       None)
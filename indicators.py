@@ -6,6 +6,12 @@ def ema(ohlc_arr, n=3, seed='sma'):
     '''
     ohlc_arr is any list of dicts with length > 3
     dict must have following keys - 'open', 'high', 'low', 'close', 'timestamp'
+
+    EMA of the last n closes only, started from the SMA of every earlier
+    close (seed='sma') or the close just before them (seed=None). This is
+    not the running EMA streaming.EMA keeps, which is seeded from the
+    first n closes and carries through the whole series, the two agree
+    only for seed='sma' and exactly 2n bars.
     '''
     if len(ohlc_arr) < n + 1:
         return None
@@ -22,6 +28,7 @@ def ema(ohlc_arr, n=3, seed='sma'):
     for ohlc in arr:
         close = float(ohlc['close'])
         ema = (close * c) + (ema_prev * (1 - c))
+        ema_prev = ema
     return ema
 
 
@@ -34,12 +41,48 @@ def sma(ohlc_arr):
     return float(total / len(ohlc_arr))
 
 
+GANN_ANGLES = (0.02, 0.04, 0.08, 0.1, 0.15, 0.25, 0.35,
+               0.40, 0.42, 0.46, 0.48, 0.5, 0.67, 1.0)
+
+
 def gann(price=0, direction='up'):
-    angles = (0.02, 0.04, 0.08, 0.1, 0.15, 0.25, 0.35,
-              0.40, 0.42, 0.46, 0.48, 0.5, 0.67, 1.0)
+    angles = GANN_ANGLES
     if direction == 'up':
         return [round_off((sqrt(price) + a) ** 2) for a in angles]
     elif direction == 'down':
         return [round_off((sqrt(price) - a) ** 2) for a in angles]
     else:
         return None
+
+
+class GannLevels:
+    '''
+    Buy, target and stoploss levels from gann() for an ltp, cached per
+    tick_size price bucket. Consecutive ltps in the same bucket return
+    the current levels without a lookup, gann() only runs for buckets
+    that have not been seen before.
+    '''
+    def __init__(self, buy=4, target=-1, stoploss=5, tick_size=0.05, size=4096):
+        self.buy = buy
+        self.target = target
+        self.stoploss = stoploss
+        self.tick_size = tick_size
+        self.size = size
+        self.cache = {}
+        self.band = None
+        self.levels = None
+
+    def get(self, ltp):
+        bucket = int(round(ltp / self.tick_size))
+        if bucket == self.band:
+            return self.levels
+        levels = self.cache.get(bucket)
+        if levels is None:
+            up = gann(ltp)
+            levels = (up[self.buy], up[self.target], gann(ltp, 'down')[self.stoploss])
+            if len(self.cache) >= self.size:
+                self.cache.clear()
+            self.cache[bucket] = levels
+        self.band = bucket
+        self.levels = levels
+        return levels
@@ -0,0 +1,128 @@
+import json
+import os
+from datetime import date
+from time import perf_counter
+from utils import create_logger
+
+JOURNAL_DIR = 'journal'
+SNAPSHOT_FILE = 'snapshot.json'
+LOG_FILE = 'journal.jsonl'
+SNAPSHOT_FREQ = 30
+
+
+class Journal:
+    '''
+    Write-ahead log of strategy state plus periodic compact snapshots,
+    one directory per trading day so a restart never picks up yesterday's
+    positions. record() appends a strategy's state as one json line and
+    flushes it before returning, checkpoint() atomically replaces the
+    snapshot with every strategy's state and starts a new log.
+
+    load() is the snapshot with newer log lines applied on top. Lines
+    carry a sequence number, so a crash between writing a snapshot and
+    truncating the log replays nothing twice, and a line cut short by a
+    crash is dropped.
+    '''
+    def __init__(self, root=JOURNAL_DIR, day=None, interval=SNAPSHOT_FREQ, sync=False):
+        self.logger = create_logger(self.__class__.__name__)
+        self.path = os.path.join(root, (day or date.today()).strftime('%d-%m-%Y'))
+        self.interval = interval
+        # fsync survives power loss, a flush is enough when only the process dies
+        self.sync = sync
+        self.seq = 0
+        self.file = None
+        self.last_checkpoint = perf_counter()
+
+    def load(self):
+        '''Latest state of every strategy, keyed like record()'''
+        states = {}
+        snapshot = os.path.join(self.path, SNAPSHOT_FILE)
+        if os.path.exists(snapshot):
+            with open(snapshot) as f:
+                saved = json.load(f)
+            self.seq = saved['seq']
+            states.update(saved['strategies'])
+        replayed = 0
+        log = os.path.join(self.path, LOG_FILE)
+        if os.path.exists(log):
+            good = 0
+            with open(log, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line.decode())
+                    except ValueError:
+                        entry = None
+                    if entry is None or not line.endswith(b'\n'):
+                        # cut off by the crash, later writes must not land behind it
+                        self.logger.warning('Dropped a torn journal line')
+                        break
+                    good += len(line)
+                    if entry['seq'] <= self.seq:
+                        continue
+                    self.seq = entry['seq']
+                    states[entry['key']] = entry['state']
+                    replayed += 1
+            if good < os.path.getsize(log):
+                with open(log, 'r+b') as f:
+                    f.truncate(good)
+        if states:
+            self.logger.info('Loaded state of %d strategies, %d journal entries after snapshot' %
+                             (len(states), replayed))
+        return states
+
+    def open(self):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.file = open(os.path.join(self.path, LOG_FILE), 'a')
+        self.last_checkpoint = perf_counter()
+
+    def record(self, key, state):
+        self.seq += 1
+        self.file.write(json.dumps({'seq': self.seq, 'key': key, 'state': state}) + '\n')
+        self._flush(self.file)
+
+    def due(self):
+        return perf_counter() - self.last_checkpoint >= self.interval
+
+    def checkpoint(self, states):
+        tmp = os.path.join(self.path, SNAPSHOT_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'seq': self.seq, 'strategies': states}, f)
+            self._flush(f)
+        os.replace(tmp, os.path.join(self.path, SNAPSHOT_FILE))
+        self.file.close()
+        self.file = open(os.path.join(self.path, LOG_FILE), 'w')
+        self.last_checkpoint = perf_counter()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _flush(self, f):
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+
+
+def broker_state(client):
+    '''
+    Net positions and the day's order book from the broker, both keyed by
+    lowercased symbol. Positions are summed over products, orders are
+    oldest first.
+    '''
+    positions = {}
+    for row in client.get_positions() or ():
+        sym = str(row['symbol']).lower()
+        pos = positions.setdefault(sym, {'quantity': 0, 'avg_price': 0.0, 'realised': 0.0})
+        qty = int(row.get('net_quantity') or 0)
+        if qty:
+            side = 'avg_buy_price' if qty > 0 else 'avg_sell_price'
+            pos['avg_price'] = float(row.get(side) or 0)
+        pos['quantity'] += qty
+        pos['realised'] += float(row.get('realized_profit') or 0)
+    orders = {}
+    book = sorted(client.get_order_history() or (), key=lambda o: int(o.get('time_in_micro') or 0))
+    for o in book:
+        orders.setdefault(str(o['symbol']).lower(), []).append(o)
+    return positions, orders
@@ -0,0 +1,114 @@
+import os
+import argparse
+from datetime import datetime, timedelta
+from threading import Thread
+from time import sleep, perf_counter
+from upstox_api import api as upstox
+from manager import Manager
+from mockupstox import MockUpstox
+from niftyoptions import GannNiftyOptions
+
+RESULTS_DIR = 'bench_results'
+CONFIG = os.path.join(RESULTS_DIR, 'loadtest.ini')
+DURATION = 5
+MAX_LAG = 0.01
+
+
+class Sink:
+    '''Passive strategy that only timestamps what it receives'''
+    def __init__(self, symbols):
+        self.symbols = tuple(s.lower() for s in symbols)
+        self.received = 0
+        self.last_quote = None
+
+    def get_symbols(self):
+        return self.symbols
+
+    def setup(self, client=None):
+        pass
+
+    def process_quote(self, quote):
+        self.received += 1
+        self.last_quote = perf_counter()
+
+    def process_order(self, order):
+        pass
+
+    def process_trade(self, trade):
+        pass
+
+
+def _start(rate, symbols, gann, duration, **kwargs):
+    client = MockUpstox.with_nifty_chain(tick_rate=rate, strikes=max(symbols // 2, 1), **kwargs)
+    if not os.path.exists(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    m = Manager(CONFIG)
+    m.attach_client(client, use_cache=False)
+    insts = list(upstox.master_contracts_by_symbol['nse_fo'].values())[:symbols]
+    client.subscribe(insts, upstox.LiveFeedType.LTP, exchange='nse_fo')
+    sink = Sink([i.symbol for i in insts])
+    m.add_strategy(sink)
+    if gann:
+        m.add_strategy(GannNiftyOptions())
+    m.opening = datetime.now() - timedelta(minutes=1)
+    m.cutoff = datetime.now() + timedelta(seconds=duration)
+    t = Thread(target=m.main_loop, daemon=True)
+    t.start()
+    return client, m, sink, t
+
+
+def run_rate(rate, symbols=10, gann=False, duration=DURATION):
+    client, m, sink, t = _start(rate, symbols, gann, duration)
+    t.join()
+    p = m.latency.percentiles((50, 99))
+    return {'rate': rate,
+            'sent': client.sent,
+            'processed': m.latency.count,
+            'conflated': m.quotes.collapsed,
+            'achieved': (m.latency.count + m.quotes.collapsed) / float(duration),
+            'p50_ms': p.get(50, 0) * 1000,
+            'p99_ms': p.get(99, 0) * 1000}
+
+
+def max_sustainable_rate(start=1000, symbols=10, gann=False, duration=DURATION):
+    '''Doubles the tick rate until the Manager falls behind the feed'''
+    rate = start
+    best = None
+    while True:
+        r = run_rate(rate, symbols, gann, duration)
+        print(r)
+        if r['achieved'] < rate * 0.95 or r['p99_ms'] > MAX_LAG * 1000:
+            return best
+        best = r
+        rate *= 2
+
+
+def reconnect_time(rate=1000, symbols=10, disconnect_after=2, wait=30):
+    client, m, sink, t = _start(rate, symbols, False, wait + disconnect_after)
+    sleep(disconnect_after)
+    client.inject_disconnect()
+    dropped = perf_counter()
+    while perf_counter() - dropped < wait:
+        if sink.last_quote is not None and sink.last_quote > dropped:
+            m.running = False
+            return sink.last_quote - dropped
+        sleep(0.001)
+    m.running = False
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test Manager against MockUpstox')
+    parser.add_argument('--rate', type=int, default=1000)
+    parser.add_argument('--symbols', type=int, default=10)
+    parser.add_argument('--duration', type=int, default=DURATION)
+    parser.add_argument('--gann', action='store_true')
+    parser.add_argument('--max', action='store_true', help='search for the max sustainable rate')
+    parser.add_argument('--reconnect', action='store_true', help='measure time to resume after a disconnect')
+    args = parser.parse_args()
+    if args.max:
+        print('Max sustainable - %s' % max_sustainable_rate(args.rate, args.symbols, args.gann, args.duration))
+    elif args.reconnect:
+        print('Resumed after %s seconds' % reconnect_time(args.rate, args.symbols))
+    else:
+        print(run_rate(args.rate, args.symbols, args.gann, args.duration))
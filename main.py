@@ -12,8 +12,9 @@ l.addHandler(fh)
 def main():
     m = Manager('config.ini')
     m.login_upstox()
+    # a restart during the session picks up where the journal left off
+    m.enable_journal()
     o = GannNiftyOptions()
-    o.setup(m.client)
     m.add_strategy(o)
     m.main_loop()
 
@@ -1,15 +1,33 @@
 import os
 import configparser
 from logging import DEBUG
-from queue import Queue
-from time import sleep
+from queue import Empty
+from threading import Event, Thread
+from time import sleep, perf_counter
 from datetime import date, datetime
 from upstox_api import api
-from urllib3.exceptions import MaxRetryError
 import utils
+from routing import Router, normalize_symbols
+from buffers import ConflatingQueue, BoundedQueue, BLOCK
+from supervisor import FeedSupervisor
+from models import Tick
+from bars import BarAggregator
+from ohlcstore import OHLCStore
+from risk import RiskEngine, LIMITS
+from journal import Journal, JOURNAL_DIR, SNAPSHOT_FREQ, broker_state
+from sessions import SessionPool, DEFAULT_SECTION, ACCOUNT_PREFIX, login, account_sections
+from workers import WORKER_MODES
+from contracts import ContractStore, load_master_contract
+from metrics import Histogram, Metrics, NULL_METRICS, MetricsServer, SnapshotWriter
 
-MAX_LOGIN_TRIES = 10
+# how often the pre-open wait checks the clock
 TIMEOUT = 10
+RISK_SECTION = 'risk'
+WATCHDOG_FREQ = 1.0
+LATENCY_REPORT_FREQ = 60
+EVENT_QUEUE_SIZE = 10000
+# a producer stuck this long on a full queue gives up with queue.Full instead of hanging
+EVENT_QUEUE_TIMEOUT = 5.0
 
 
 class Manager:
@@ -31,15 +49,40 @@ class Manager:
         self.config = configparser.ConfigParser()
         self.config.read(config_name)
         self.opening, self.cutoff = utils.get_trade_hours(date.today())
-        self.last_update = None
 
         self.client = None
-        self.bots = []
-        self.quotes = Queue()
-        self.orders = Queue()
-        self.trades = Queue()
+        self.contracts = None
+        self.router = Router()
+        self.bots = self.router.strategies
+        self.quotes = ConflatingQueue()
+        self.orders = BoundedQueue(EVENT_QUEUE_SIZE, BLOCK, EVENT_QUEUE_TIMEOUT)
+        self.trades = BoundedQueue(EVENT_QUEUE_SIZE, BLOCK, EVENT_QUEUE_TIMEOUT)
+        self.bar_events = BoundedQueue(EVENT_QUEUE_SIZE, BLOCK, EVENT_QUEUE_TIMEOUT)
+        self.bars = BarAggregator(self._bar_closed)
+        self.ohlc = None
+        self.wakeup = Event()
+        self.supervisor = FeedSupervisor(self._snapshot_handler)
+        self.sessions = SessionPool(self._order_ack)
+        self.gateway = self.sessions.default.gateway
+        self.risk = RiskEngine()
+        self._load_risk_limits()
+
+        self.workers = {}
+        self.worker_class = None
+        self.max_workers = 0
+        self.intents = None
+        self.recorder = None
+        self.latency = Histogram()
+        self.metrics = NULL_METRICS
+        self.instrumented = False
+        self.metric_exporters = []
+        self._strategy_timers = {}
+        self.journal = None
+        self.journaled = {}
+        self.restored = {}
+        self._journal_keys = {}
+        self._reconcile_keys = []
 
-        self.subbed_stocks = []
         self.running = False
 
     def create_config_file(self):
@@ -53,51 +96,68 @@ class Manager:
             self.logger.info("Updated config File")
 
     def login_upstox(self):
-        creds = self.config['userinfo']
-        if creds['key'] == '0':
-            creds['key'] = input('Please enter the API key - ')
-            self.logger.debug('Received new API key')
-        if creds['secret'] == '0':
-            creds['secret'] = input('Please enter the API secret - ')
-            self.logger.debug('Received new API secret')
-
-        tries = 0
-        s = api.Session(creds['key'])
-        s.set_redirect_uri('http://127.0.0.1')
-        s.set_api_secret(creds['secret'])
-        while tries < MAX_LOGIN_TRIES:
-            try:
-                self.client = api.Upstox(creds['key'], creds['token'])
-                self.logger.info('Logged in successfully.')
-                break
-            except MaxRetryError:
-                self.logger.exception('Unable to login- check internet connection')
-            except Exception as e:
-                if 'Invalid Bearer token' in e.args[0]:
-                    url = s.get_login_url()
-                    print('New token required. Auth url - ')
-                    print(url)
-                    code = input("Please enter the code from the login page - ")
-                    s.set_code(code)
-                    creds['token'] = s.retrieve_access_token()
-                    self.logger.info('Received new upstox auth token')
-            tries += 1
-
+        self.client = login(self.config[DEFAULT_SECTION], self.logger)
         if self.client is None:
             return
 
+        self.attach_client(self.client)
+        self.login_accounts(save=False)
+        self.config[DEFAULT_SECTION]['last_login'] = datetime.now().strftime('%d-%m-%Y %H:%M')
+        self._save_config()
+
+    def login_accounts(self, save=True):
+        for section in account_sections(self.config):
+            name = section[len(ACCOUNT_PREFIX):]
+            self.logger.info('Logging in account %s' % name)
+            client = login(self.config[section], self.logger)
+            if client is None:
+                self.logger.warning('Could not log in account %s' % name)
+                continue
+            self.add_account(name, client)
+            self.config[section]['last_login'] = datetime.now().strftime('%d-%m-%Y %H:%M')
+        if save:
+            self._save_config()
+
+    def add_account(self, name, client):
+        self.sessions.attach(name, client, self.order_handler, self.trade_handler)
+        self.logger.info('Trading account %s attached' % name)
+
+    def _save_config(self):
+        with open(self.config_name, 'w') as cf:
+            self.config.write(cf)
+            self.logger.info('Updated config file')
+
+    def _load_risk_limits(self):
+        '''[risk] holds the defaults, [risk:<account>] overrides them per account'''
+        for section in self.config.sections():
+            if section != RISK_SECTION and not section.startswith(RISK_SECTION + ':'):
+                continue
+            account = section[len(RISK_SECTION) + 1:] or None
+            limits = {}
+            for key, value in self.config[section].items():
+                if key not in LIMITS:
+                    self.logger.warning('Ignoring unknown risk limit %s in [%s]' % (key, section))
+                    continue
+                limits[key] = None if value.lower() in ('', 'none') else float(value)
+            self.risk.set_limits(account, **limits)
+
+    def attach_client(self, client, use_cache=True):
+        self.client = client
+        self.sessions.attach(self.sessions.default.name, client)
         self.logger.info('Loading master contracts')
+        if use_cache and self.contracts is None:
+            self.contracts = ContractStore()
         try:
-            nse_fo = self.client.get_master_contract('nse_fo')
+            nse_fo = self._load_contracts('nse_fo')
             if nse_fo:
                 self.logger.info('NSE F&O loaded %d contracts' % len(nse_fo))
         except Exception as e:
             self.logger.exception('Couldn\'nt load NSE_FO master contract')
         try:
             self.client.enabled_exchanges.append('nse_index')
-            nse_index = self.client.get_master_contract('nse_index')
+            nse_index = self._load_contracts('nse_index')
             if nse_index:
-                self.logger.info('NSE Index loaded %d contracts' % len(nse_fo))
+                self.logger.info('NSE Index loaded %d contracts' % len(nse_index))
         except Exception as e:
             self.logger.exception('Couldn\'nt load NSE_INDEX master contract')
 
@@ -106,12 +166,12 @@ class Manager:
         self.client.set_on_trade_update(self.trade_handler)
         self.client.set_on_disconnect(self._disconnect_handler)
 
-        creds['last_login'] = datetime.now().strftime('%d-%m-%Y %H:%M')
-        with open(self.config_name, 'w') as cf:
-            self.config.write(cf)
-            self.logger.info('Updated config file')
+    def _load_contracts(self, exchange):
+        if self.contracts is None:
+            return self.client.get_master_contract(exchange)
+        return load_master_contract(self.client, exchange, self.contracts)
 
-    def main_loop(self, freq=0.2):
+    def main_loop(self, timeout=1.0):
         if datetime.now() < self.opening:
             print('Waiting for trade hours to start')
             try:
@@ -128,66 +188,25 @@ class Manager:
         self.running = True
         self.logger.info('Starting websocket')
         print('Starting websocket')
-        self.client.start_websocket(True)
-        self.last_update = datetime.now()
+        self._start_workers()
+        self.sessions.start(self.client)
+        self.reconcile()
+        self._sync_subscriptions()
+        self.supervisor.start(self.client)
+        watchdog = Thread(target=self._watchdog, name='watchdog', daemon=True)
+        watchdog.start()
         try:
             print('Entering main loop')
             while self.running:
-                if self.last_update is not None:
-                    diff = datetime.now() - self.last_update
-                    if diff.seconds > TIMEOUT:
-                        self.logger.debug('No update received in over %d seconds' % TIMEOUT)
-                        self._reconnect()
-                if datetime.now() > self.cutoff:
-                    self.logger.info('Trade hours over. Exiting main loop')
-                    self._stop()
-                    self.running = False
-
-                try:
-                    while not self.quotes.empty():
-                        m = self.quotes.get()
-                        sym = m['symbol'].lower()
-                        for bot in self.bots:
-                            if sym in bot[0]:
-                                order = bot[1].process_quote(m)
-                                if order is not None:
-                                    self.client.place_order(order['transaction'],
-                                                            order['instrument'],
-                                                            order['quantity'],
-                                                            order['order_type'],
-                                                            order['product'],
-                                                            order['buy_price'],
-                                                            None,
-                                                            0,
-                                                            api.DurationType.DAY,
-                                                            order['stoploss'],
-                                                            order['target'],
-                                                            None)
-                        self.quotes.task_done()
-                except Exception as e:
-                    self.logger.exception('Exception while handling quote update.')
-                try:
-                    while not self.orders.empty():
-                        m = self.orders.get()
-                        sym = m['symbol'].lower()
-                        for bot in self.bots:
-                            if sym in bot[0]:
-                                bot[1].process_order(m)
-                        self.orders.task_done()
-                except Exception as e:
-                    self.logger.exception('Exception while handling trade update.')
-
-                try:
-                    while not self.trades.empty():
-                        m = self.trades.get()
-                        sym = m['symbol'].lower()
-                        for bot in self.bots:
-                            if sym in bot[0]:
-                                bot[1].process_trade(m)
-                        self.trades.task_done()
-                except Exception as e:
-                    self.logger.exception('Exception while handling trade update.')
-                sleep(freq)
+                # handlers set the event, the timeout only keeps Ctrl-C responsive
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
+                self._process_quotes()
+                self._process_bars()
+                self._process_orders()
+                self._process_trades()
+                if self.journal is not None and self.journal.due():
+                    self._checkpoint()
 
         except KeyboardInterrupt:
             self.logger.info('Forced exit by user')
@@ -195,69 +214,487 @@ class Manager:
             self.logger.exception('Unknown error in manager.main_loop')
         finally:
             self._unsubscribe_all()
+            self._process_bars()
+            self._stop_workers()
+            self.sessions.stop()
+            if self.journal is not None:
+                self._checkpoint()
+                self.journal.close()
+            if self.recorder is not None:
+                self.recorder.stop()
+            for exporter in self.metric_exporters:
+                exporter.stop()
+            self._log_latency()
+
+    def place_order(self, order, account=None):
+        reason = self.risk.check(order, account)
+        if reason is not None:
+            self.risk.rejected(account)
+            self.logger.warning('Order for %s blocked by risk: %s' %
+                                (order['instrument'].symbol, reason))
+            # already on the main loop, queueing here would block on a full queue only we drain
+            self._dispatch_order(self._risk_reject(order, account, reason))
+            return
+        self.risk.submitted(order, account)
+        self.sessions.submit(order, account)
+
+    def _risk_reject(self, order, account, reason):
+        inst = order['instrument']
+        ack = {'symbol': inst.symbol,
+               'instrument': inst,
+               'exchange': inst.exchange,
+               'transaction_type': order['transaction'].value,
+               'quantity': order['quantity'],
+               'price': order['buy_price'],
+               'order_id': 'NA',
+               'status': 'rejected',
+               'message': reason,
+               'gateway': True,
+               'risk': True}
+        if account is not None:
+            ack['account'] = account
+        return ack
 
-    def add_strategy(self, bot):
-        self.bots.append((bot.get_symbols(), bot))
-        syms = bot.get_symbols()
-        if syms is not None:
-            bot.setup(self.client)
-            syms = bot.get_symbols()
+    def enable_metrics(self, port=None, path=None, interval=5):
+        self.metrics = Metrics()
+        self.latency = self.metrics.histogram('tick_to_decision')
+        self.metrics.gauge('quotes_depth', self.quotes.qsize)
+        self.metrics.gauge('orders_depth', self.orders.qsize)
+        self.metrics.gauge('trades_depth', self.trades.qsize)
+        self.metrics.gauge('bars_depth', self.bar_events.qsize)
+        self.metrics.gauge('quotes_conflated', lambda: self.quotes.collapsed)
+        self.metrics.gauge('orders_stalls', lambda: self.orders.stalls)
+        self.metrics.gauge('trades_stalls', lambda: self.trades.stalls)
+        self.metrics.gauge('gateway_pending', self.sessions.pending)
+        self.metrics.gauge('risk_realised', lambda: self.risk.total('realised'))
+        self.metrics.gauge('risk_unrealised', lambda: self.risk.total('unrealised'))
+        self.metrics.gauge('risk_margin', lambda: self.risk.total('margin'))
+        self.metrics.gauge('risk_rejects', lambda: self.risk.total('rejects'))
+        self._strategy_timers = {}
+        if port is not None:
+            self.metric_exporters.append(MetricsServer(self.metrics, port))
+        if path is not None:
+            self.metric_exporters.append(SnapshotWriter(self.metrics, path, interval))
+        for exporter in self.metric_exporters:
+            exporter.start()
+        self.instrumented = True
 
-        for s in bot.get_symbols():
-            self.subbed_stocks.append(s)
+    def _order_ack(self, ack):
+        self.orders.offer((perf_counter(), ack))
+        self.wakeup.set()
+
+    def _process_quotes(self):
+        while True:
+            try:
+                received, m = self.quotes.get_nowait()
+            except Empty:
+                return
+            try:
+                self.risk.mark(m.symbol, m.ltp)
+                if self.instrumented:
+                    self._process_quote_timed(received, m)
+                else:
+                    for bot in self.router.get(m.symbol):
+                        order = bot.process_quote(m)
+                        if order is not None:
+                            self._journal(bot)
+                            self.place_order(order, self.sessions.owner(bot))
+                self.latency.record(perf_counter() - received)
+            except Exception as e:
+                self.logger.exception('Exception while handling quote update.')
+
+    def _process_quote_timed(self, received, m):
+        start = perf_counter()
+        self.metrics.histogram('quote_wait').record(start - received)
+        self.metrics.counter('ticks').incr()
+        for bot in self.router.get(m.symbol):
+            timer = self._strategy_timers.get(id(bot))
+            if timer is None:
+                timer = self._strategy_timers[id(bot)] = self.metrics.histogram(
+                    'process_quote.%s-%x' % (bot.__class__.__name__, id(bot)))
+            t = perf_counter()
+            order = bot.process_quote(m)
+            timer.record(perf_counter() - t)
+            if order is not None:
+                self.metrics.counter('orders').incr()
+                self._journal(bot)
+                self.place_order(order, self.sessions.owner(bot))
+
+    def _process_bars(self):
+        fed = {}
+        while True:
+            try:
+                received, bar = self.bar_events.get_nowait()
+            except Empty:
+                break
+            try:
+                for bot in self.router.get(bar['symbol']):
+                    if bar['interval'] in getattr(bot, 'bar_intervals', ()):
+                        bot.on_bar(bar)
+                        fed[id(bot)] = bot
+            except Exception as e:
+                self.logger.exception('Exception while handling bar close.')
+        # strategies that batch per bar close, like the scanner, publish once drained
+        for bot in fed.values():
+            if hasattr(bot, 'flush'):
+                try:
+                    bot.flush()
+                except Exception as e:
+                    self.logger.exception('Exception while flushing bar updates.')
+
+    def _process_orders(self):
+        while True:
+            try:
+                received, m = self.orders.get_nowait()
+            except Empty:
+                return
+            self._dispatch_order(m)
+
+    def _dispatch_order(self, m):
+        # recorded here rather than on the gateway lanes, a histogram has one writer
+        if self.instrumented and 'latency' in m:
+            self.metrics.histogram('order_round_trip').record(m['latency'])
+        try:
+            self.risk.on_order(m)
+            for bot in self.sessions.route(m.get('account'), m['symbol'].lower()):
+                bot.process_order(m)
+                self._journal(bot)
+        except Exception as e:
+            self.logger.exception('Exception while handling order update.')
+
+    def _process_trades(self):
+        while True:
+            try:
+                received, m = self.trades.get_nowait()
+            except Empty:
+                return
+            try:
+                self.risk.on_trade(m)
+                for bot in self.sessions.route(m.get('account'), m['symbol'].lower()):
+                    bot.process_trade(m)
+                    self._journal(bot)
+            except Exception as e:
+                self.logger.exception('Exception while handling trade update.')
+
+    def _watchdog(self):
+        last_report = perf_counter()
+        while self.running:
+            sleep(WATCHDOG_FREQ)
+            if self.router.refresh():
+                self.sessions.refresh()
+                self.logger.debug('Strategy symbols changed, rebuilt routes')
+                self._sync_subscriptions()
+                for bot in self.bots:
+                    self._track_bars(bot)
+            self.supervisor.check()
+            self.bars.expire()
+            if datetime.now() > self.cutoff:
+                self.logger.info('Trade hours over. Exiting main loop')
+                # the day's last bars close with the session
+                self.bars.expire(force=True)
+                self.running = False
+                self.wakeup.set()
+            if perf_counter() - last_report > LATENCY_REPORT_FREQ:
+                self._log_latency()
+                last_report = perf_counter()
+
+    def _log_latency(self):
+        if not self.latency.count:
+            return
+        if self.quotes.collapsed:
+            self.logger.info('Conflated %d stale quotes' % self.quotes.collapsed)
+        p = self.latency.percentiles((50, 90, 99, 100))
+        self.logger.info('Tick-to-decision latency over %d ticks (ms) - '
+                         'p50 %.3f | p90 %.3f | p99 %.3f | max %.3f' %
+                         (self.latency.count, p[50] * 1000, p[90] * 1000,
+                          p[99] * 1000, p[100] * 1000))
+
+    def attach_recorder(self, recorder):
+        self.recorder = recorder
+        if not recorder.is_alive():
+            recorder.start()
+
+    def enable_workers(self, mode='thread', max_workers=None):
+        if self.bots or self.workers:
+            raise RuntimeError('Worker mode must be set before adding strategies')
+        self.worker_class, queue_class = WORKER_MODES[mode]
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.intents = queue_class()
+        self.logger.info('Running strategies on up to %d %s workers' %
+                         (self.max_workers, mode))
+
+    def enable_journal(self, root=JOURNAL_DIR, interval=SNAPSHOT_FREQ, sync=False):
+        '''
+        Journals strategy state under root and restores strategies added
+        afterwards from today's journal, if there is one.
+        '''
+        if self.bots:
+            raise RuntimeError('Journal must be enabled before adding strategies')
+        self.journal = Journal(root, interval=interval, sync=sync)
+        self.restored = self.journal.load()
+        self.journal.open()
+
+    def add_strategy(self, bot, group=None, account=None, key=None):
+        '''key names the strategy in the journal, class name and count by default'''
+        client = self.sessions.get(account).client or self.client
+        self._restore(bot, key, client)
+        if bot.get_symbols() is None:
+            bot.setup(client)
+        if self.worker_class is None:
+            self.router.add(bot)
+            self.sessions.assign(bot, account)
+            self._track_bars(bot)
+        else:
+            worker = self._get_worker(group, account)
+            worker.add(bot)
+            self.router.rebuild()
+            self.sessions.rebuild()
+            self._track_bars(worker)
+        self.logger.debug('Routing %d symbols to %d strategies' %
+                          (len(self.router), len(self.bots)))
+
+    def reconcile(self):
+        '''
+        Checks strategies restored from the journal against the broker's
+        positions and order book, and loads the broker's positions into
+        the risk engine.
+        '''
+        if not self._reconcile_keys:
+            return
+        accounts = {}
+        for key in self._reconcile_keys:
+            bot = self.journaled[key]
+            accounts.setdefault(self.sessions.owner(bot), []).append((key, bot))
+        self._reconcile_keys = []
+        for account, bots in accounts.items():
+            client = self.sessions.get(account).client or self.client
+            try:
+                positions, orders = broker_state(client)
+            except Exception as e:
+                self.logger.exception('Could not query broker state for account %s, '
+                                      'keeping journaled state' % account)
+                continue
+            for sym, pos in positions.items():
+                self.risk.sync(sym, pos['quantity'], pos['avg_price'], pos['realised'], account)
+            net = {sym: pos['quantity'] for sym, pos in positions.items()}
+            for key, bot in bots:
+                if not hasattr(bot, 'reconcile'):
+                    continue
+                if bot.reconcile(net, orders):
+                    self.logger.warning('%s differed from the broker, reconciled' % key)
+                    self._journal(bot)
+
+    def _restore(self, bot, key, client):
+        if self.journal is None or self.worker_class is not None or \
+                not hasattr(bot, 'snapshot'):
+            return
+        if key is None:
+            n = 0
+            while '%s-%d' % (bot.__class__.__name__, n) in self.journaled:
+                n += 1
+            key = '%s-%d' % (bot.__class__.__name__, n)
+        self.journaled[key] = bot
+        self._journal_keys[id(bot)] = key
+        state = self.restored.pop(key, None)
+        if state is None:
+            return
+        try:
+            bot.restore(state, client)
+        except Exception as e:
+            self.logger.exception('Could not restore %s from the journal, running setup' % key)
+            return
+        self._reconcile_keys.append(key)
+        self.logger.info('Restored %s from the journal' % key)
+
+    def _journal(self, bot):
+        key = self._journal_keys.get(id(bot))
+        if key is None:
+            return
+        try:
+            self.journal.record(key, bot.snapshot())
+        except Exception as e:
+            self.logger.exception('Could not journal %s' % key)
+
+    def _checkpoint(self):
+        start = perf_counter()
+        try:
+            self.journal.checkpoint({key: bot.snapshot() for key, bot in self.journaled.items()})
+        except Exception as e:
+            self.logger.exception('Could not write journal snapshot')
+            return
+        self.logger.debug('Journal snapshot of %d strategies in %.1fms' %
+                          (len(self.journaled), (perf_counter() - start) * 1000))
+
+    def refresh_routes(self):
+        self.sessions.refresh()
+        return self.router.refresh()
+
+    def _get_worker(self, group=None, account=None):
+        account = self.sessions.get(account).name
+        if group is None:
+            assigned = sum(len(w.router.strategies) for w in self.workers.values())
+            group = 'worker-%d' % (assigned % self.max_workers)
+        if account != self.sessions.default.name:
+            # workers never mix accounts, their orders go out on one client
+            group = '%s-%s' % (account, group)
+        if group not in self.workers:
+            worker = self.worker_class(group, self.intents)
+            self.workers[group] = worker
+            self.router.add(worker)
+            self.sessions.assign(worker, account)
+        return self.workers[group]
+
+    def _start_workers(self):
+        if not self.workers:
+            return
+        for worker in self.workers.values():
+            worker.start()
+        Thread(target=self._collect_intents, name='intents', daemon=True).start()
+
+    def _stop_workers(self):
+        if not self.workers:
+            return
+        for worker in self.workers.values():
+            worker.stop()
+        self.intents.put(None)
+
+    def _collect_intents(self):
+        while True:
+            item = self.intents.get()
+            if item is None:
+                return
+            kind, name, payload = item
+            try:
+                if kind == 'order':
+                    self.place_order(payload, self.sessions.owner(self.workers[name]))
+                elif kind == 'symbols':
+                    self.workers[name].symbols = payload
+                    self.router.rebuild()
+                    self.sessions.rebuild()
+                    self._track_bars(self.workers[name])
+            except Exception as e:
+                self.logger.exception('Exception while handling %s from %s' % (kind, name))
+
+    def _track_bars(self, strategy):
+        intervals = getattr(strategy, 'bar_intervals', None)
+        if not intervals:
+            return
+        days = getattr(strategy, 'bar_history', 0)
+        for sym in normalize_symbols(strategy.get_symbols()):
+            added = self.bars.track(sym, intervals)
+            if added and days and self.client is not None:
+                self._load_bar_history(strategy, sym, added, days)
+
+    def _load_bar_history(self, strategy, sym, intervals, days):
+        inst = self._resolve(sym)
+        if inst is None:
+            return
+        if self.ohlc is None:
+            self.ohlc = OHLCStore()
+        for interval in intervals:
+            try:
+                bars = self.bars.load_history(self.client, self.ohlc, inst, interval, days)
+            except Exception as e:
+                self.logger.exception('Could not load %s bar history for %s' % (interval, sym))
+                continue
+            for bar in bars:
+                if self.running:
+                    self.bar_events.offer((perf_counter(), bar))
+                else:
+                    strategy.on_bar(bar)
+        if self.running:
+            self.wakeup.set()
+
+    def _bar_closed(self, bar):
+        self.bar_events.offer((perf_counter(), bar))
+        self.wakeup.set()
+
+    def _sync_subscriptions(self):
+        missing = [sym for sym in self.router.symbols() if sym not in self.supervisor.instruments]
+        insts = []
+        for sym in missing:
+            inst = self._resolve(sym)
+            if inst is None:
+                self.logger.warning('No instrument found for %s' % sym)
+            else:
+                insts.append(inst)
+        self.supervisor.track(insts)
+
+    def _resolve(self, sym):
+        exchanges = list(getattr(self.client, 'enabled_exchanges', None) or [])
+        if 'nse_index' not in exchanges:
+            exchanges.append('nse_index')
+        for exchange in exchanges:
+            try:
+                inst = self.client.get_instrument_by_symbol(exchange, sym)
+            except Exception as e:
+                continue
+            if inst is not None:
+                return inst
+        return None
 
     def quote_handler(self, message):
-        self.last_update = datetime.now()
-        inst = message['instrument']
-        if inst.symbol.lower() not in self.subbed_stocks:
+        if self.recorder is not None:
+            self.recorder.record(message)
+        tick = Tick(message)
+        if tick.symbol not in self.router:
+            self.metrics.counter('unsubscribed').incr()
             try:
-                self.client.unsubscribe(inst, api.LiveFeedType.LTP)
+                self.client.unsubscribe(tick.instrument, api.LiveFeedType.LTP)
             except Exception as e:
                 pass
         else:
-            self.quotes.put(message)
+            self.supervisor.heartbeat(tick.symbol)
+            self.bars.update(tick)
+            self.quotes.put(tick.symbol, (perf_counter(), tick))
+            self.wakeup.set()
+
+    def _snapshot_handler(self, message):
+        # a rest snapshot after a gap is the last known price, strategies
+        # and bars only see real ticks, positions are marked to it
+        tick = Tick(message)
+        if tick.symbol in self.router:
+            self.risk.mark(tick.symbol, tick.ltp)
 
-    def order_handler(self, message):
+    def order_handler(self, message, account=None):
         inst = message['instrument']
-        if inst.symbol.lower() not in self.subbed_stocks:
+        if inst.symbol.lower() not in self.router:
+            self.metrics.counter('unsubscribed').incr()
             try:
                 self.client.unsubscribe(inst, api.LiveFeedType.LTP)
             except Exception as e:
                 pass
         else:
-            self.orders.put(message)
+            if account is not None:
+                message['account'] = account
+            self.orders.offer((perf_counter(), message))
+            self.wakeup.set()
 
-    def trade_handler(self, message):
+    def trade_handler(self, message, account=None):
         inst = message['instrument']
-        if inst.symbol.lower() not in self.subbed_stocks:
+        if inst.symbol.lower() not in self.router:
+            self.metrics.counter('unsubscribed').incr()
             try:
                 self.client.unsubscribe(inst, api.LiveFeedType.LTP)
             except Exception as e:
                 pass
         else:
-            self.orders.put(message)
+            if account is not None:
+                message['account'] = account
+            self.trades.offer((perf_counter(), message))
+            self.wakeup.set()
 
     def _unsubscribe_all(self):
         self.running = False
-        for stock in self.subbed_stocks:
+        self.supervisor.stop()
+        for inst in self.supervisor.instruments.values():
             try:
-                self.client.unsubscribe(stock, api.LiveFeedType.LTP)
+                self.client.unsubscribe(inst, api.LiveFeedType.LTP)
             except Exception as e:
                 pass
-        self.subbed_stocks.clear()
-        if self.client.websocket is not None:
-            self.client.websocket.keep_running = False
+        self.wakeup.set()
 
     def _disconnect_handler(self, message):
         self.logger.info('Websocket Disconnected')
-
-    def _reconnect(self):
-        print("reconnecting")
-        self.logger.info('Reconnecting websocket')
-        for inst in self.subbed_stocks:
-            try:
-                self.client.subscribe(inst, api.LiveFeedType.LTP)
-            except Exception as e:
-                pass
-        self.client.start_websocket(True)
-
+        if self.running:
+            self.supervisor.on_disconnect()
@@ -0,0 +1,244 @@
+import os
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread, Event
+from time import time
+from utils import create_logger
+
+SUB_BITS = 8
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+MAX_BITS = 40
+SNAPSHOT_INTERVAL = 5
+
+
+class Histogram:
+    '''
+    HDR style log-linear histogram. Values are recorded in seconds and
+    bucketed as integer multiples of unit, a bucket reads at most 1/128
+    (under 1%) below the values in it. record() is a few integer
+    operations on a preallocated list and takes no lock, so each
+    histogram must have a single recording thread. Readers on other
+    threads work from a copy of the counts.
+    '''
+    __slots__ = ('unit', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, unit=1e-6):
+        self.unit = unit
+        self.counts = [0] * (SUB_COUNT + (MAX_BITS - SUB_BITS) * HALF_COUNT)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        v = int(seconds / self.unit)
+        if v < SUB_COUNT:
+            idx = v if v > 0 else 0
+        else:
+            shift = v.bit_length() - SUB_BITS
+            idx = shift * HALF_COUNT + (v >> shift)
+            if idx >= len(self.counts):
+                idx = len(self.counts) - 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def value_at(self, idx):
+        if idx < SUB_COUNT:
+            return idx * self.unit
+        shift = (idx - SUB_COUNT) // HALF_COUNT + 1
+        return ((idx - shift * HALF_COUNT) << shift) * self.unit
+
+    def percentiles(self, pcts=(50, 90, 99)):
+        counts = list(self.counts)
+        return self._percentiles(counts, sum(counts), self.max, pcts)
+
+    def _percentiles(self, counts, count, maximum, pcts):
+        if not count:
+            return {}
+        out = {}
+        targets = sorted(pcts)
+        seen = 0
+        t = 0
+        for idx, c in enumerate(counts):
+            if not c:
+                continue
+            seen += c
+            while t < len(targets) and seen >= count * targets[t] / 100.0:
+                out[targets[t]] = maximum if targets[t] >= 100 else min(self.value_at(idx), maximum)
+                t += 1
+            if t == len(targets):
+                break
+        for p in targets[t:]:
+            out[p] = maximum
+        return out
+
+    def snapshot(self):
+        counts = list(self.counts)
+        count, total, maximum = sum(counts), self.total, self.max
+        p = self._percentiles(counts, count, maximum, (50, 90, 99, 99.9))
+        return {'count': count,
+                'mean': total / count if count else 0.0,
+                'p50': p.get(50, 0.0), 'p90': p.get(90, 0.0),
+                'p99': p.get(99, 0.0), 'p999': p.get(99.9, 0.0),
+                'max': maximum}
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class Counter:
+    '''
+    Rate is since the same reader's previous snapshot, so exporters
+    polling at their own pace don't shorten each other's windows.
+    '''
+    __slots__ = ('value', 'created', 'reads')
+
+    def __init__(self):
+        self.value = 0
+        self.created = time()
+        self.reads = {}
+
+    def incr(self, n=1):
+        self.value += n
+
+    def snapshot(self, reader=None):
+        now, value = time(), self.value
+        last, last_time = self.reads.get(reader, (0, self.created))
+        self.reads[reader] = (value, now)
+        return {'value': value, 'rate': (value - last) / max(now - last_time, 1e-9)}
+
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def histogram(self, name):
+        h = self.histograms.get(name)
+        if h is None:
+            h = self.histograms[name] = Histogram()
+        return h
+
+    def counter(self, name):
+        c = self.counters.get(name)
+        if c is None:
+            c = self.counters[name] = Counter()
+        return c
+
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def snapshot(self, reader=None):
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception as e:
+                gauges[name] = None
+        return {'time': time(),
+                'histograms': {k: h.snapshot() for k, h in list(self.histograms.items())},
+                'counters': {k: c.snapshot(reader) for k, c in list(self.counters.items())},
+                'gauges': gauges}
+
+
+class _NullHistogram:
+    count = 0
+
+    def record(self, seconds):
+        pass
+
+
+class _NullCounter:
+    def incr(self, n=1):
+        pass
+
+
+class NullMetrics:
+    '''Same interface as Metrics, every call is a no-op'''
+    histograms = {}
+    counters = {}
+    gauges = {}
+    _histogram = _NullHistogram()
+    _counter = _NullCounter()
+
+    def histogram(self, name):
+        return self._histogram
+
+    def counter(self, name):
+        return self._counter
+
+    def gauge(self, name, fn):
+        pass
+
+    def snapshot(self, reader=None):
+        return {}
+
+
+NULL_METRICS = NullMetrics()
+
+
+class SnapshotWriter(Thread):
+    '''Periodically writes Metrics.snapshot() as json, replacing the file atomically'''
+    def __init__(self, metrics, path, interval=SNAPSHOT_INTERVAL):
+        super().__init__(name='metrics-snapshot', daemon=True)
+        self.logger = create_logger(self.__class__.__name__)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.metrics.snapshot(self), f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            self.logger.exception('Could not write metrics snapshot')
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
+
+
+class MetricsServer(Thread):
+    '''Serves the current snapshot as json on http://127.0.0.1:<port>/metrics'''
+    def __init__(self, metrics, port):
+        super().__init__(name='metrics-server', daemon=True)
+        metrics_ref = metrics
+        reader = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics_ref.snapshot(reader)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', port), Handler)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,239 @@
+import random
+from datetime import date, datetime, timedelta
+from threading import Thread, Lock
+from time import sleep, perf_counter, time
+from upstox_api import api as upstox
+from backtest import SimulatedBroker, quote
+from utils import get_expiry_dates, create_logger, round_off
+
+TICK_RATE = 1000
+BATCH = 100
+INDEX_SYMBOL = 'NIFTY_50'
+STRIKE_STEP = 100
+
+
+class MockWebSocket:
+    def __init__(self):
+        self.keep_running = True
+
+
+class MockUpstox:
+    '''
+    Local stand-in for upstox_api.api.Upstox. Serves master contracts,
+    live feeds, ohlc and order placement from memory and pushes synthetic
+    quote, order and trade callbacks at tick_rate ticks/s once the
+    websocket is started. Orders are matched by backtest.SimulatedBroker.
+    '''
+    def __init__(self, tick_rate=TICK_RATE, order_latency=0.0, disconnect_every=None, seed=0):
+        self.logger = create_logger(self.__class__.__name__)
+        self.enabled_exchanges = ['nse_fo']
+        self.contracts = {}
+        self.prices = {}
+        self.subscribed = {}
+        self.tick_rate = tick_rate
+        self.order_latency = order_latency
+        self.disconnect_every = disconnect_every
+        self.random = random.Random(seed)
+        self.broker = SimulatedBroker()
+        self.lock = Lock()
+        self.websocket = None
+        self.feed_thread = None
+        self.sent = 0
+        self.disconnects = 0
+        self.on_quote_update = None
+        self.on_order_update = None
+        self.on_trade_update = None
+        self.on_disconnect = None
+        self.next_token = 1
+        self.order_book = {}
+
+    @classmethod
+    def with_nifty_chain(cls, spot=10000.0, expiry=None, strikes=10, **kwargs):
+        client = cls(**kwargs)
+        client.add_instrument('nse_index', INDEX_SYMBOL, spot)
+        if expiry is None:
+            # same expiry rule as GannNiftyOptions.setup
+            tod = date.today()
+            expiry = get_expiry_dates(tod.month)[-1]
+            if expiry - tod < timedelta(days=6):
+                expiry = get_expiry_dates(tod.month + 1)[-1]
+        base = int(spot / 100) * 100
+        for i in range(-strikes, strikes + 1):
+            strike = base + i * STRIKE_STEP
+            prefix = 'nifty' + expiry.strftime('%y%b').lower() + str(strike)
+            client.add_instrument('nse_fo', prefix + 'ce', cls._option_price(spot - strike), strike)
+            client.add_instrument('nse_fo', prefix + 'pe', cls._option_price(strike - spot), strike)
+        return client
+
+    @staticmethod
+    def _option_price(moneyness):
+        return round_off(max(moneyness, 0) + 80 * 0.997 ** abs(moneyness) + 5, 0.05)
+
+    def add_instrument(self, exchange, symbol, price, strike=None, lot_size=75):
+        inst = upstox.Instrument(exchange, self.next_token, None, symbol.upper(), symbol.upper(),
+                                 price, None, strike, 0.05, lot_size, None, None)
+        self.next_token += 1
+        self.contracts.setdefault(exchange, []).append(inst)
+        # served as if already downloaded, into the module dicts the real client keeps them in
+        upstox.master_contracts_by_symbol.setdefault(exchange, {})[symbol.lower()] = inst
+        upstox.master_contracts_by_token.setdefault(exchange, {})[inst.token] = inst
+        self.prices[symbol.lower()] = price
+        return inst
+
+    def get_master_contract(self, exchange):
+        exchange = exchange.lower()
+        if exchange not in upstox.master_contracts_by_token and exchange in self.contracts:
+            insts = self.contracts[exchange]
+            upstox.master_contracts_by_symbol[exchange] = {i.symbol.lower(): i for i in insts}
+            upstox.master_contracts_by_token[exchange] = {i.token: i for i in insts}
+        return upstox.master_contracts_by_token.get(exchange)
+
+    def get_instrument_by_symbol(self, exchange, symbol):
+        return upstox.master_contracts_by_symbol.get(exchange.lower(), {}).get(symbol.lower())
+
+    def get_instrument_by_token(self, exchange, token):
+        return upstox.master_contracts_by_token.get(exchange.lower(), {}).get(token)
+
+    def get_live_feed(self, instrument, live_feed_type):
+        ltp = self.prices[instrument.symbol.lower()]
+        feed = quote(instrument, int(time() * 1000), ltp)
+        if live_feed_type == upstox.LiveFeedType.Full:
+            feed.update({'open': instrument.closing_price, 'high': max(ltp, instrument.closing_price),
+                         'low': min(ltp, instrument.closing_price), 'close': instrument.closing_price,
+                         'vtt': 0, 'bids': [{'price': ltp - 0.05, 'quantity': 75, 'orders': 1}],
+                         'asks': [{'price': ltp + 0.05, 'quantity': 75, 'orders': 1}]})
+        return feed
+
+    def get_ohlc(self, instrument, interval, start_date, end_date):
+        rnd = random.Random(instrument.token)
+        price = instrument.closing_price
+        bars = []
+        day = start_date
+        while day <= end_date:
+            if day.weekday() < 5:
+                o = price
+                c = max(o + rnd.gauss(0, o * 0.01), 0.05)
+                bars.append({'timestamp': int(datetime(day.year, day.month, day.day).timestamp() * 1000),
+                             'open': o, 'high': max(o, c) * 1.003, 'low': min(o, c) * 0.997,
+                             'close': c, 'volume': rnd.randint(1000, 100000)})
+                price = c
+            day += timedelta(days=1)
+        return bars
+
+    def subscribe(self, instrument, live_feed_type, exchange=None):
+        instruments = instrument if isinstance(instrument, list) else [instrument]
+        with self.lock:
+            for inst in instruments:
+                if not hasattr(inst, 'symbol'):
+                    return {'success': False, 'message': 'Invalid instrument'}
+                self.subscribed[inst.symbol.lower()] = inst
+        return {'success': True, 'symbol': [i.symbol for i in instruments]}
+
+    def unsubscribe(self, instrument, live_feed_type):
+        instruments = instrument if isinstance(instrument, list) else [instrument]
+        with self.lock:
+            for inst in instruments:
+                self.subscribed.pop(getattr(inst, 'symbol', str(inst)).lower(), None)
+        return {'success': True}
+
+    def place_order(self, transaction_type, instrument, quantity, order_type,
+                    product_type, price=None, trigger_price=None, disclosed_quantity=None,
+                    duration=None, stop_loss=None, square_off=None, trailing_ticks=None):
+        if self.order_latency:
+            sleep(self.order_latency)
+        order = {'transaction': transaction_type, 'instrument': instrument,
+                 'quantity': quantity, 'order_type': order_type, 'product': product_type,
+                 'buy_price': price, 'stoploss': stop_loss, 'target': square_off}
+        with self.lock:
+            events = self.broker.place(order, int(time() * 1000))
+        self._push(events)
+        return {'order_id': events[0][1]['order_id']}
+
+    def get_positions(self):
+        rows = []
+        with self.lock:
+            for sym, qty in self.broker.positions.items():
+                avg = self.broker.avg_price.get(sym, 0.0)
+                rows.append({'symbol': sym.upper(), 'net_quantity': qty,
+                             'avg_buy_price': avg if qty > 0 else 0.0,
+                             'avg_sell_price': avg if qty < 0 else 0.0,
+                             'realized_profit': 0.0})
+        return rows
+
+    def get_order_history(self, order_id=None):
+        with self.lock:
+            if order_id is not None:
+                return [self.order_book[str(order_id)]]
+            return list(self.order_book.values())
+
+    def set_on_quote_update(self, fn):
+        self.on_quote_update = fn
+
+    def set_on_order_update(self, fn):
+        self.on_order_update = fn
+
+    def set_on_trade_update(self, fn):
+        self.on_trade_update = fn
+
+    def set_on_disconnect(self, fn):
+        self.on_disconnect = fn
+
+    def start_websocket(self, run_in_background=False):
+        if self.websocket is not None:
+            self.websocket.keep_running = False
+        self.websocket = MockWebSocket()
+        if run_in_background:
+            self.feed_thread = Thread(target=self._feed, args=(self.websocket,),
+                                      name='mock-websocket', daemon=True)
+            self.feed_thread.start()
+        else:
+            self._feed(self.websocket)
+
+    def inject_disconnect(self):
+        if self.websocket is None:
+            return
+        self.websocket.keep_running = False
+        self.disconnects += 1
+        self.logger.debug('Injected disconnect')
+        if self.on_disconnect is not None:
+            self.on_disconnect('Connection closed')
+
+    def _feed(self, ws):
+        start = perf_counter()
+        sent = 0
+        while ws.keep_running:
+            with self.lock:
+                insts = list(self.subscribed.values())
+            if not insts:
+                sleep(0.01)
+                continue
+            for i in range(BATCH):
+                self._tick(insts[(sent + i) % len(insts)])
+            sent += BATCH
+            self.sent += BATCH
+            if self.disconnect_every and sent >= self.disconnect_every:
+                self.inject_disconnect()
+                return
+            ahead = sent / float(self.tick_rate) - (perf_counter() - start)
+            if ahead > 0:
+                sleep(ahead)
+
+    def _tick(self, inst):
+        sym = inst.symbol.lower()
+        ltp = max(round_off(self.prices[sym] + self.random.gauss(0, 0.1), 0.05), 0.05)
+        self.prices[sym] = ltp
+        tick = quote(inst, int(time() * 1000), ltp)
+        with self.lock:
+            events = self.broker.match(tick)
+        if self.on_quote_update is not None:
+            self.on_quote_update(tick)
+        self._push(events)
+
+    def _push(self, events):
+        for kind, m in events:
+            if kind == 'o':
+                with self.lock:
+                    self.order_book[m['order_id']] = m
+            handler = self.on_order_update if kind == 'o' else self.on_trade_update
+            if handler is not None:
+                handler(m)
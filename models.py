@@ -0,0 +1,172 @@
+from enum import IntFlag
+from utils import BUY
+
+TICK_FIELDS = frozenset(('symbol', 'token', 'exchange', 'instrument', 'timestamp', 'ltp'))
+FILLED = ('complete', 'completed')
+DONE = FILLED + ('cancelled', 'rejected')
+ORDER_FIELDS = frozenset(('transaction', 'instrument', 'quantity', 'order_type', 'product',
+                          'buy_price', 'stoploss', 'target'))
+
+
+class State(IntFlag):
+    INITIALISED = 0
+    SETUP = 1
+    ORDER_PLACED = 2
+    REJECTED = 4
+    POSITION_OPEN = 8
+    POSITION_CLOSED = 16
+    FINISHED = 32
+
+
+class Tick:
+    '''
+    A quote as the Manager hands it to strategies. Built once per
+    message in quote_handler with the symbol already lowercased, item
+    access falls back to the raw upstox message so dict-style
+    strategies keep working.
+    '''
+    __slots__ = ('symbol', 'token', 'exchange', 'instrument', 'timestamp', 'ltp', 'message')
+
+    def __init__(self, message):
+        inst = message['instrument']
+        self.instrument = inst
+        self.symbol = inst.symbol.lower()
+        self.token = inst.token
+        self.exchange = inst.exchange
+        self.timestamp = message.get('timestamp')
+        self.ltp = message['ltp']
+        self.message = message
+
+    def __getitem__(self, key):
+        if key in TICK_FIELDS:
+            return getattr(self, key)
+        return self.message[key]
+
+    def __contains__(self, key):
+        return key in TICK_FIELDS or key in self.message
+
+    def get(self, key, default=None):
+        if key in TICK_FIELDS:
+            return getattr(self, key)
+        return self.message.get(key, default)
+
+    def __repr__(self):
+        return 'Tick(%s, %s, %s)' % (self.symbol, self.timestamp, self.ltp)
+
+
+class OrderIntent:
+    '''
+    An order a strategy wants placed, in the shape OrderGateway and
+    SimulatedBroker read with item access.
+    '''
+    __slots__ = ('transaction', 'instrument', 'quantity', 'order_type', 'product',
+                 'buy_price', 'stoploss', 'target', 'symbol')
+
+    def __init__(self, transaction, instrument, quantity, order_type, product,
+                 buy_price, stoploss=None, target=None):
+        self.transaction = transaction
+        self.instrument = instrument
+        self.quantity = quantity
+        self.order_type = order_type
+        self.product = product
+        self.buy_price = buy_price
+        self.stoploss = stoploss
+        self.target = target
+        self.symbol = instrument.symbol.lower()
+
+    def __getitem__(self, key):
+        if key in ORDER_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in ORDER_FIELDS
+
+    def get(self, key, default=None):
+        if key in ORDER_FIELDS:
+            return getattr(self, key)
+        return default
+
+    def __repr__(self):
+        return 'OrderIntent(%s %s x%s @ %s)' % (self.transaction.name, self.symbol,
+                                                 self.quantity, self.buy_price)
+
+
+class PositionState:
+    '''
+    Lifecycle flags and holdings of one strategy in one instrument.
+    ORDER_PLACED is cleared by whatever happens to the order next, so
+    it is set only while an order is outstanding.
+    '''
+    __slots__ = ('flags', 'holdings', 'order_id')
+
+    def __init__(self):
+        self.flags = State.INITIALISED
+        self.holdings = 0
+        self.order_id = None
+
+    def ordered(self):
+        self.flags |= State.ORDER_PLACED
+
+    def cancelled(self):
+        self.flags &= ~State.ORDER_PLACED
+
+    def rejected(self):
+        self.flags = self.flags & ~State.ORDER_PLACED | State.REJECTED
+
+    def bought(self, quantity, order_id):
+        self.order_id = order_id
+        self.holdings += quantity
+        self.flags = self.flags & ~(State.ORDER_PLACED | State.POSITION_CLOSED) | State.POSITION_OPEN
+
+    def sold(self, quantity, order_id):
+        self.order_id = order_id
+        self.holdings -= quantity
+        if self.holdings < 1:
+            self.flags = self.flags & ~(State.ORDER_PLACED | State.POSITION_OPEN) | State.POSITION_CLOSED
+            return True
+        return False
+
+    def snapshot(self):
+        return (int(self.flags), self.holdings, self.order_id)
+
+    def restore(self, state):
+        flags, self.holdings, self.order_id = state
+        self.flags = State(flags)
+
+    def reconcile(self, net, entry=None):
+        '''
+        Brings flags and holdings in line with the broker after a restart.
+        net is the broker's net quantity in the instrument, entry the most
+        recent entry order for it from the broker's order book. Returns
+        True if anything changed.
+        '''
+        before = (self.flags, self.holdings)
+        status = str(entry['status']).lower() if entry is not None else None
+        unseen = entry is not None and str(entry['order_id']) != self.order_id
+        if net > 0:
+            if unseen and status in FILLED:
+                self.order_id = str(entry['order_id'])
+            self.holdings = net
+            self.flags = self.flags & ~(State.ORDER_PLACED | State.POSITION_CLOSED) | State.POSITION_OPEN
+        elif self.holdings > 0 or (self.flags & State.ORDER_PLACED and unseen and status in FILLED):
+            # filled and exited while we were down
+            if unseen:
+                self.order_id = str(entry['order_id'])
+            self.holdings = 0
+            self.flags = self.flags & ~(State.ORDER_PLACED | State.POSITION_OPEN) | State.POSITION_CLOSED
+        elif self.flags & State.ORDER_PLACED and (entry is None or status in DONE):
+            # never reached the broker, or died there
+            self.cancelled()
+        return (self.flags, self.holdings) != before
+
+    def __repr__(self):
+        return 'PositionState(%r, holdings=%d)' % (self.flags, self.holdings)
+
+
+def entry_order(orders, symbol):
+    '''Latest order in symbol that opened a position rather than exiting one'''
+    for o in reversed(orders.get(symbol, ())):
+        if str(o.get('parent_order_id') or 'NA') == 'NA' and str(o['transaction_type']) == BUY:
+            return o
+    return None
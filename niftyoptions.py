@@ -1,30 +1,35 @@
-from time import sleep
 from datetime import date, timedelta
 from upstox_api import api as upstox
 from utils import BUY, SELL, get_expiry_dates, create_logger
 from gannbot import GannBot
+from optionchain import OptionChain
+from models import State
 
 
 N50_SYMBOL = 'NIFTY_50'
 LOT_SIZE = 75
 
 MAX_CYCLES = 2
+STRIKE_BAND = 400
 
 
 class GannNiftyOptions:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, strike_band=STRIKE_BAND, max_cycles=MAX_CYCLES, params=None):
         self.running = False
+        self.strike_band = strike_band
+        self.max_cycles = max_cycles
+        self.chain = {}
         self.cycles = 0
         self.logger = create_logger(self.__class__.__name__)
-        self.state = []
+        self.state = State.INITIALISED
 
-        self.pe_bot = GannBot()
+        self.pe_bot = GannBot(params=params)
         self.pe_symbol = None
-        self.ce_bot = GannBot()
+        self.ce_bot = GannBot(params=params)
         self.ce_symbol = None
 
     def setup(self, client=None):
-        if 'setup complete' in self.state:
+        if self.state & State.SETUP:
             return
         self.logger.debug('Creating options symbols')
         tod = date.today()
@@ -36,94 +41,118 @@ class GannNiftyOptions:
         nearest_100 = int(float(data['close']) / 100) * 100
         self.logger.debug('Base price for options = %d' % nearest_100)
 
-        self._create_ce_symbol(client, nearest_100, exp)
-        ce_inst = client.get_instrument_by_symbol('nse_fo', self.ce_symbol)
-        while client.subscribe(ce_inst, upstox.LiveFeedType.LTP)['success'] is not True:
-            sleep(1)
-        else:
-            self.logger.debug('Subscribed to %s' % self.ce_symbol)
-            self.logger.debug('close = %f' % ce_inst.closing_price)
-            pass
-
-        self._create_pe_symbol(client, nearest_100, exp)
-        pe_inst = client.get_instrument_by_symbol('nse_fo', self.pe_symbol)
-        while client.subscribe(pe_inst, upstox.LiveFeedType.LTP)['success'] is not True:
-            sleep(1)
-        else:
-            self.logger.debug('Subscribed to %s' % self.pe_symbol)
-            self.logger.debug('close = %f' % pe_inst.closing_price)
-            pass
-
-        self.state.append('setup complete')
-        self.logger.debug(self.state[-1])
+        with OptionChain(client) as chain:
+            self.chain = chain.fetch(nearest_100, exp, self.strike_band)
+            ce, pe = chain.cheapest('ce'), chain.cheapest('pe')
+            if ce is None or pe is None:
+                raise RuntimeError('No option quotes within %d of %d for expiry %s' %
+                                   (self.strike_band, nearest_100, exp.strftime('%d-%m-%Y')))
+            self.ce_symbol = ce['symbol'].lower()
+            self.pe_symbol = pe['symbol'].lower()
+            ce_inst = client.get_instrument_by_symbol('nse_fo', self.ce_symbol)
+            pe_inst = client.get_instrument_by_symbol('nse_fo', self.pe_symbol)
+            subs = [chain.subscribe(ce_inst), chain.subscribe(pe_inst)]
+            for sub in subs:
+                inst = sub.result()
+                self.logger.debug('Subscribed to %s' % inst.symbol.lower())
+                self.logger.debug('close = %f' % inst.closing_price)
+
+        self.state |= State.SETUP
+        self.logger.debug('setup complete')
 
     def process_quote(self, quote):
         sym = quote['symbol'].lower()
-        pe_order = None
-        ce_order = None
         if sym == self.pe_symbol:
-            pe_order = self.pe_bot.process_quote(quote)
+            bot = self.pe_bot
         elif sym == self.ce_symbol:
-            ce_order = self.ce_bot.process_quote(quote)
-
-        if self.state[-1] in ('setup complete') and self.cycles < MAX_CYCLES:
-            if pe_order is not None and 'pe position closed' not in self.state:
-                self.state.append('pe ordered')
-                return pe_order
-            elif ce_order is not None and 'ce position closed' not in self.state:
-                self.state.append('ce ordered')
-                return ce_order
-        elif self.cycles == MAX_CYCLES:
-            self.state.append('finished trading')
+            bot = self.ce_bot
+        else:
+            return None
+        order = bot.process_quote(quote)
+        if order is None:
+            return None
+
+        # one leg at a time, and a leg that has closed is not traded again
+        if (self.state == State.SETUP and self.cycles < self.max_cycles and
+                not bot.position.flags & State.POSITION_CLOSED):
+            self.state |= State.ORDER_PLACED
+            return order
+        bot.position.cancelled()
+        if self.cycles >= self.max_cycles:
+            self.state |= State.FINISHED
+        return None
 
     def process_order(self, order):
         sym = order['symbol'].lower()
         if sym == self.pe_symbol:
-            self.pe_bot.process_order(order)
+            bot = self.pe_bot
         elif sym == self.ce_symbol:
-            self.ce_bot.process_order(order)
+            bot = self.ce_bot
+        else:
+            return
+        bot.process_order(order)
+        if order['status'].lower() == 'rejected':
+            self.state &= ~State.ORDER_PLACED
 
     def process_trade(self, trade):
         self._log_trade(trade)
         sym = trade['symbol'].lower()
         if sym == self.pe_symbol:
-            self.pe_bot.process_trade(trade)
-            newstate = 'pe ' + self.pe_bot.state[-1]
+            bot = self.pe_bot
         elif sym == self.ce_symbol:
-            self.ce_bot.process_trade(trade)
-            newstate = 'ce ' + self.pe_bot.state[-1]
-        if newstate != self.state[-1]:
-            self.state.append(newstate)
-
-        if 'position closed' in self.state[-1]:
+            bot = self.ce_bot
+        else:
+            return
+        was_open = bot.position.flags & State.POSITION_OPEN
+        bot.process_trade(trade)
+        flags = bot.position.flags
+        if flags & State.POSITION_OPEN:
+            self.state = self.state & ~State.ORDER_PLACED | State.POSITION_OPEN
+        elif was_open and flags & State.POSITION_CLOSED:
+            self.state &= ~State.POSITION_OPEN
             self.cycles += 1
+            if self.cycles >= self.max_cycles:
+                self.state |= State.FINISHED
 
     def get_symbols(self):
-        if 'setup complete' not in self.state:
+        if not self.state & State.SETUP:
             return None
         return (self.pe_symbol, self.ce_symbol)
 
-    def _create_pe_symbol(self, client, nearest_100, expiry):
-        exp = expiry
-        puts = []
-        for i in range(-400, 0, 100):
-            sym = 'nifty' + exp.strftime('%y%b').lower() + str(nearest_100 + i) + 'pe'
-            feed = client.get_live_feed(client.get_instrument_by_symbol('nse_fo', sym),
-                                        upstox.LiveFeedType.Full)
-            puts.append(feed)
-        puts_sorted = sorted(puts, key=lambda k: float(k['close']))
-        self.pe_symbol = puts_sorted[0]['symbol'].lower()
-
-    def _create_ce_symbol(self, client, nearest_100, expiry):
-        exp = expiry
-        calls = []
-        for i in range(0, 400, 100):
-            sym = 'nifty' + exp.strftime('%y%b').lower() + str(nearest_100 + i) + 'ce'
-            feed = client.get_live_feed(client.get_instrument_by_symbol('nse_fo', sym),
-                                        upstox.LiveFeedType.Full)
-            calls.append(feed)
-        calls_sorted = sorted(calls, key=lambda k: float(k['close']))
-        self.ce_symbol = calls_sorted[0]['symbol'].lower()
+    def snapshot(self):
+        return {'state': int(self.state),
+                'cycles': self.cycles,
+                'ce_symbol': self.ce_symbol,
+                'pe_symbol': self.pe_symbol,
+                'ce_bot': self.ce_bot.snapshot(),
+                'pe_bot': self.pe_bot.snapshot()}
+
+    def restore(self, state, client=None):
+        '''Picks up the strikes chosen before a restart instead of rerunning setup'''
+        self.state = State(state['state'])
+        self.cycles = state['cycles']
+        self.ce_symbol = state['ce_symbol']
+        self.pe_symbol = state['pe_symbol']
+        self.ce_bot.restore(state['ce_bot'], client)
+        self.pe_bot.restore(state['pe_bot'], client)
+
+    def reconcile(self, positions, orders):
+        changed = False
+        for bot in (self.ce_bot, self.pe_bot):
+            if not bot.reconcile(positions, orders):
+                continue
+            changed = True
+            flags = bot.position.flags
+            if flags & State.POSITION_OPEN:
+                self.state = self.state & ~State.ORDER_PLACED | State.POSITION_OPEN
+            elif flags & State.POSITION_CLOSED:
+                self.state &= ~(State.ORDER_PLACED | State.POSITION_OPEN)
+                self.cycles += 1
+            else:
+                self.state &= ~State.ORDER_PLACED
+        if self.cycles >= self.max_cycles:
+            self.state |= State.FINISHED
+        return changed
 
     def _log_trade(self, trade_info=None):
         if trade_info is None:
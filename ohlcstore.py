@@ -0,0 +1,122 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from threading import Lock
+from contracts import CACHE_DIR
+from utils import create_logger
+
+OHLC_DB = 'ohlc.db'
+WORKERS = 4
+BAR_FIELDS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+
+
+def interval_key(interval):
+    return getattr(interval, 'value', interval)
+
+
+def missing_ranges(days, fromdt, todt):
+    '''Contiguous (start, end) date ranges in fromdt..todt that are not in days'''
+    ranges = []
+    start = None
+    d = fromdt
+    while d <= todt:
+        if d not in days:
+            if start is None:
+                start = d
+        elif start is not None:
+            ranges.append((start, d - timedelta(days=1)))
+            start = None
+        d += timedelta(days=1)
+    if start is not None:
+        ranges.append((start, todt))
+    return ranges
+
+
+class OHLCStore:
+    '''
+    Local bar store keyed by (exchange, symbol, interval). Dates already
+    fetched are remembered per day so get() only asks the client for the
+    missing ranges, the current day is never marked complete. Bars are
+    deduplicated on timestamp and kept in memory once read.
+    '''
+    def __init__(self, path=None):
+        self.logger = create_logger(self.__class__.__name__)
+        if path is None:
+            if not os.path.exists(CACHE_DIR):
+                os.makedirs(CACHE_DIR)
+            path = os.path.join(CACHE_DIR, OHLC_DB)
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS bars (exchange, symbol, interval, '
+                            'timestamp INTEGER, open, high, low, close, volume, '
+                            'PRIMARY KEY (exchange, symbol, interval, timestamp))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS fetched (exchange, symbol, interval, day, '
+                            'PRIMARY KEY (exchange, symbol, interval, day))')
+        self.bars = {}
+        self.days = {}
+        self.fetches = 0
+
+    def get(self, client, instrument, interval, fromdt, todt):
+        key = (instrument.exchange.lower(), instrument.symbol.lower(), interval_key(interval))
+        days = self._fetched_days(key)
+        for start, end in missing_ranges(days, fromdt, todt):
+            self._fetch(client, instrument, interval, key, start, end)
+        lo = _day_start(fromdt)
+        hi = _day_start(todt + timedelta(days=1))
+        return [b for b in self._load(key) if lo <= b['timestamp'] < hi]
+
+    def warm(self, client, instruments, interval, fromdt, todt, workers=WORKERS):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(lambda i: self.get(client, i, interval, fromdt, todt), instruments)
+            return {i.symbol.lower(): bars for i, bars in zip(instruments, results)}
+
+    def _fetched_days(self, key):
+        days = self.days.get(key)
+        if days is None:
+            with self.lock:
+                rows = self.db.execute('SELECT day FROM fetched WHERE exchange = ? AND '
+                                       'symbol = ? AND interval = ?', key).fetchall()
+            days = self.days[key] = set(date.fromordinal(r[0]) for r in rows)
+        return days
+
+    def _fetch(self, client, instrument, interval, key, start, end):
+        self.logger.debug('Fetching %s %s bars for %s to %s' % (key[1], key[2], start, end))
+        data = client.get_ohlc(instrument, interval, start, end) or []
+        self.fetches += 1
+        rows = [key + tuple(_num(bar.get(f)) for f in BAR_FIELDS) for bar in data]
+        today = date.today()
+        done = [key + (d.toordinal(),) for d in _days(start, min(end, today - timedelta(days=1)))]
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.db.executemany('INSERT OR IGNORE INTO fetched VALUES (?, ?, ?, ?)', done)
+        self.days[key].update(date.fromordinal(d[3]) for d in done)
+        self.bars.pop(key, None)
+
+    def _load(self, key):
+        bars = self.bars.get(key)
+        if bars is None:
+            with self.lock:
+                rows = self.db.execute('SELECT %s FROM bars WHERE exchange = ? AND symbol = ? '
+                                       'AND interval = ? ORDER BY timestamp' % ', '.join(BAR_FIELDS),
+                                       key).fetchall()
+            bars = self.bars[key] = [dict(zip(BAR_FIELDS, r)) for r in rows]
+        return bars
+
+
+def _num(value):
+    if value is None:
+        return None
+    return float(value) if '.' in str(value) else int(value)
+
+
+def _days(start, end):
+    d = start
+    while d <= end:
+        yield d
+        d += timedelta(days=1)
+
+
+def _day_start(d):
+    return int(datetime(d.year, d.month, d.day).timestamp() * 1000)
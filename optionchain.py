@@ -0,0 +1,83 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from upstox_api import api as upstox
+from utils import create_logger
+
+STRIKE_STEP = 100
+WORKERS = 8
+SUBSCRIBE_TRIES = 20
+BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+
+
+def option_symbol(underlying, expiry, strike, kind):
+    return underlying + expiry.strftime('%y%b').lower() + str(strike) + kind
+
+
+class OptionChain:
+    '''
+    Fetches full quotes for a band of strikes concurrently on a bounded
+    pool and keeps the result as a snapshot for strike selection.
+    Calls are strikes base to base + band, puts base - band to base.
+    '''
+    def __init__(self, client, underlying='nifty', exchange='nse_fo',
+                 step=STRIKE_STEP, workers=WORKERS):
+        self.logger = create_logger(self.__class__.__name__)
+        self.client = client
+        self.underlying = underlying
+        self.exchange = exchange
+        self.step = step
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.snapshot = {}
+
+    def fetch(self, base, expiry, band=400):
+        syms = [option_symbol(self.underlying, expiry, base + i, 'ce')
+                for i in range(0, band, self.step)]
+        syms += [option_symbol(self.underlying, expiry, base + i, 'pe')
+                 for i in range(-band, 0, self.step)]
+        feeds = self.pool.map(self._get_feed, syms)
+        self.snapshot = {sym: feed for sym, feed in zip(syms, feeds) if feed is not None}
+        self.logger.debug('Fetched %d of %d strikes' % (len(self.snapshot), len(syms)))
+        return self.snapshot
+
+    def cheapest(self, kind):
+        feeds = [f for sym, f in self.snapshot.items() if sym.endswith(kind)]
+        if not feeds:
+            return None
+        return min(feeds, key=lambda k: float(k['close']))
+
+    def subscribe(self, instrument, feed_type=upstox.LiveFeedType.LTP):
+        return self.pool.submit(subscribe_with_backoff, self.client, instrument, feed_type)
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+    def _get_feed(self, sym):
+        inst = self.client.get_instrument_by_symbol(self.exchange, sym)
+        if inst is None:
+            return None
+        try:
+            return self.client.get_live_feed(inst, upstox.LiveFeedType.Full)
+        except Exception as e:
+            self.logger.exception('Could not fetch %s' % sym)
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def subscribe_with_backoff(client, instrument, feed_type, tries=SUBSCRIBE_TRIES):
+    delay = BACKOFF
+    for i in range(tries):
+        try:
+            if client.subscribe(instrument, feed_type)['success'] is True:
+                return instrument
+        except Exception as e:
+            pass
+        sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, MAX_BACKOFF)
+    raise RuntimeError('Could not subscribe to %s' % instrument.symbol)
@@ -0,0 +1,161 @@
+import os
+import mmap
+from array import array
+from datetime import datetime
+from queue import Queue, Empty
+from threading import Thread
+from time import time, perf_counter
+from utils import create_logger
+
+COLUMNS = (('timestamp', 'q'), ('ltp', 'd'), ('volume', 'q'), ('bid', 'd'), ('ask', 'd'))
+COLUMN_EXT = '.col'
+TICK_DIR = 'ticks'
+BATCH_SIZE = 4096
+FLUSH_INTERVAL = 1.0
+
+
+def instrument_dir(root, day, exchange, symbol):
+    return os.path.join(root, day, exchange, symbol)
+
+
+def _to_row(message):
+    ts = message.get('timestamp')
+    ts = int(ts) if ts else int(time() * 1000)
+    bids = message.get('bids')
+    asks = message.get('asks')
+    bid = float(bids[0]['price']) if bids else float('nan')
+    ask = float(asks[0]['price']) if asks else float('nan')
+    volume = message.get('vtt')
+    return (ts, float(message['ltp']), int(volume) if volume else 0, bid, ask)
+
+
+class TickRecorder(Thread):
+    '''
+    Appends every quote to one file per column under
+    <root>/<dd-mm-YYYY>/<exchange>/<symbol>/. record() only enqueues the
+    message, conversion and disk writes happen on this thread in batches.
+    '''
+    def __init__(self, root=TICK_DIR):
+        super().__init__(name='tick-recorder', daemon=True)
+        self.logger = create_logger(self.__class__.__name__)
+        self.root = root
+        self.queue = Queue()
+        self.buffers = {}
+        self.pending = 0
+        self.recorded = 0
+        self.running = False
+
+    def record(self, message):
+        self.queue.put(message)
+
+    def stop(self):
+        self.running = False
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        self.running = True
+        last_flush = perf_counter()
+        while True:
+            try:
+                m = self.queue.get(timeout=FLUSH_INTERVAL)
+            except Empty:
+                m = ()
+            if m is None:
+                break
+            if m:
+                try:
+                    self._buffer(m)
+                except Exception as e:
+                    self.logger.exception('Could not record quote')
+            if self.pending >= BATCH_SIZE or perf_counter() - last_flush > FLUSH_INTERVAL:
+                self.flush()
+                last_flush = perf_counter()
+        self.flush()
+
+    def _buffer(self, m):
+        row = _to_row(m)
+        day = datetime.fromtimestamp(row[0] / 1000).strftime('%d-%m-%Y')
+        key = (day, str(m.get('exchange', 'na')).lower(), m['symbol'].lower())
+        cols = self.buffers.get(key)
+        if cols is None:
+            cols = self.buffers[key] = [array(code) for name, code in COLUMNS]
+        for col, value in zip(cols, row):
+            col.append(value)
+        self.pending += 1
+
+    def flush(self):
+        if not self.pending:
+            return
+        for (day, exchange, symbol), cols in self.buffers.items():
+            if not cols[0]:
+                continue
+            path = instrument_dir(self.root, day, exchange, symbol)
+            if not os.path.exists(path):
+                os.makedirs(path)
+            for (name, code), col in zip(COLUMNS, cols):
+                with open(os.path.join(path, name + COLUMN_EXT), 'ab') as f:
+                    col.tofile(f)
+                del col[:]
+        self.recorded += self.pending
+        self.pending = 0
+
+
+class TickReader:
+    '''
+    Memory-maps the column files of one instrument-day. Columns are
+    exposed as typed memoryviews, a partially written last row is ignored.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._maps = []
+        self.columns = {}
+        for name, code in COLUMNS:
+            fname = os.path.join(path, name + COLUMN_EXT)
+            if os.path.getsize(fname) == 0:
+                self.columns[name] = memoryview(array(code))
+                continue
+            with open(fname, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mm)
+            size = array(code).itemsize
+            self.columns[name] = memoryview(mm)[:len(mm) // size * size].cast(code)
+        n = min(len(c) for c in self.columns.values())
+        for name in self.columns:
+            self.columns[name] = self.columns[name][:n]
+        self.length = n
+
+    @classmethod
+    def open(cls, day, exchange, symbol, root=TICK_DIR):
+        return cls(instrument_dir(root, day, exchange.lower(), symbol.lower()))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows(self):
+        return zip(*(self.columns[name] for name, code in COLUMNS))
+
+    def close(self):
+        for name in list(self.columns):
+            self.columns[name].release()
+        self.columns = {}
+        for mm in self._maps:
+            mm.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def list_instruments(day, root=TICK_DIR):
+    path = os.path.join(root, day)
+    if not os.path.exists(path):
+        return []
+    return [(exchange, symbol) for exchange in sorted(os.listdir(path))
+            for symbol in sorted(os.listdir(os.path.join(path, exchange)))]
@@ -0,0 +1,290 @@
+from collections import deque
+from threading import Lock
+from utils import BUY, create_logger
+
+DEFAULT_ACCOUNT = 'default'
+TERMINAL = ('complete', 'completed', 'cancelled', 'rejected')
+
+# None switches a check off, margin is notional times margin_rate
+LIMITS = {'max_order_qty': None,
+          'max_order_value': None,
+          'max_position_qty': None,
+          'max_open_orders': None,
+          'max_margin': None,
+          'max_loss': None,
+          'margin_rate': 1.0}
+
+
+class Position:
+    __slots__ = ('symbol', 'account', 'quantity', 'avg_price', 'realised', 'unrealised',
+                 'last_price', 'pending_buy', 'pending_sell')
+
+    def __init__(self, symbol, account):
+        self.symbol = symbol
+        self.account = account
+        self.quantity = 0
+        self.avg_price = 0.0
+        self.realised = 0.0
+        self.unrealised = 0.0
+        self.last_price = None
+        self.pending_buy = 0
+        self.pending_sell = 0
+
+
+class AccountRisk:
+    __slots__ = ('name', 'limits', 'overrides', 'positions', 'open_orders', 'pending', 'reserved', 'done',
+                 'realised', 'unrealised', 'margin', 'rejects')
+
+    def __init__(self, name, limits):
+        self.name = name
+        self.limits = limits
+        self.overrides = {}
+        self.positions = {}
+        self.open_orders = {}
+        self.pending = {}
+        self.reserved = 0
+        self.done = set()
+        self.realised = 0.0
+        self.unrealised = 0.0
+        self.margin = 0.0
+        self.rejects = 0
+
+
+class RiskEngine:
+    '''
+    Net positions, open orders, P&L and margin per account and instrument,
+    kept up to date from order and trade updates and marked to the last
+    quote. check() only compares an order against those running totals,
+    so a pre-trade check costs a few dict lookups.
+
+    Orders are reserved by submitted() and matched to their broker order
+    id by the first ack or order update for the same account, symbol and
+    side, the gateway keeps each symbol's orders in submission order.
+    '''
+    def __init__(self, limits=None):
+        self.logger = create_logger(self.__class__.__name__)
+        self.defaults = dict(LIMITS, **(limits or {}))
+        self.accounts = {}
+        self.holders = {}
+        self.lock = Lock()
+
+    def set_limits(self, account=None, **limits):
+        unknown = set(limits) - set(LIMITS)
+        if unknown:
+            raise ValueError('Unknown risk limits %s' % ', '.join(sorted(unknown)))
+        if account is None:
+            self.defaults.update(limits)
+            accounts = list(self.accounts.values())
+        else:
+            accounts = [self._account(account)]
+            accounts[0].overrides.update(limits)
+        # account overrides win over defaults whichever was set first
+        for acct in accounts:
+            acct.limits = dict(self.defaults, **acct.overrides)
+
+    def check(self, order, account=None):
+        '''None if the order is within limits, otherwise the reason'''
+        acct = self._account(account)
+        limits = acct.limits
+        qty = int(order['quantity'])
+        price = float(order['buy_price'] or 0)
+        buy = order['transaction'].value == BUY
+        pos = acct.positions.get(order['instrument'].symbol.lower())
+
+        if qty <= 0:
+            return 'order quantity %d not positive' % qty
+        if limits['max_order_qty'] is not None and qty > limits['max_order_qty']:
+            return 'order quantity %d over %d' % (qty, limits['max_order_qty'])
+        value = qty * price
+        if limits['max_order_value'] is not None and value > limits['max_order_value']:
+            return 'order value %.2f over %.2f' % (value, limits['max_order_value'])
+        if limits['max_open_orders'] is not None and \
+                len(acct.open_orders) + acct.reserved >= limits['max_open_orders']:
+            return '%d orders already open' % limits['max_open_orders']
+
+        net = pos.quantity if pos is not None else 0
+        if buy:
+            after = net + (pos.pending_buy if pos is not None else 0) + qty
+        else:
+            after = net - (pos.pending_sell if pos is not None else 0) - qty
+        increases = abs(after) > abs(net)
+        if not increases:
+            return None
+        if limits['max_position_qty'] is not None and abs(after) > limits['max_position_qty']:
+            return 'position %d over %d' % (abs(after), limits['max_position_qty'])
+        margin = value * limits['margin_rate']
+        if limits['max_margin'] is not None and acct.margin + margin > limits['max_margin']:
+            return 'margin %.2f over %.2f' % (acct.margin + margin, limits['max_margin'])
+        if limits['max_loss'] is not None and acct.realised + acct.unrealised <= -limits['max_loss']:
+            return 'loss limit %.2f reached' % limits['max_loss']
+        return None
+
+    def submitted(self, order, account=None):
+        acct = self._account(account)
+        sym = order['instrument'].symbol.lower()
+        qty = int(order['quantity'])
+        side = order['transaction'].value
+        margin = 0.0
+        if side == BUY:
+            margin = qty * float(order['buy_price'] or 0) * acct.limits['margin_rate']
+        with self.lock:
+            self._reserve(acct, sym, side, (qty, margin))
+            acct.pending.setdefault((sym, side), deque()).append((qty, margin))
+            acct.reserved += 1
+
+    def rejected(self, account=None):
+        self._account(account).rejects += 1
+
+    def on_order(self, m):
+        if m.get('risk'):
+            return
+        acct = self._account(m.get('account'))
+        sym = m['symbol'].lower()
+        oid = str(m.get('order_id', 'NA'))
+        side = str(m['transaction_type'])
+        status = str(m['status']).lower()
+        with self.lock:
+            if oid == 'NA':
+                # refused before it reached the exchange, a placed ack
+                # without an id waits for the broker's own update
+                if status in TERMINAL:
+                    self._release(acct, sym, side)
+            elif oid in acct.done:
+                return
+            elif oid not in acct.open_orders:
+                # first sight of the order settles the oldest reservation,
+                # exit legs of an OCO order have none
+                reserved = self._release(acct, sym, side)
+                if status in TERMINAL:
+                    acct.done.add(oid)
+                else:
+                    acct.open_orders[oid] = (sym, side, reserved)
+                    self._reserve(acct, sym, side, reserved)
+            elif status in TERMINAL:
+                sym, side, reserved = acct.open_orders.pop(oid)
+                self._unreserve(acct, sym, side, reserved)
+                acct.done.add(oid)
+
+    def on_trade(self, m):
+        acct = self._account(m.get('account'))
+        sym = m['symbol'].lower()
+        qty = int(m.get('traded_quantity') or m['quantity'])
+        price = float(m.get('traded_price') or m.get('price') or 0)
+        signed = qty if str(m['transaction_type']) == BUY else -qty
+        with self.lock:
+            pos = self._position(acct, sym)
+            net = pos.quantity
+            avg = pos.avg_price
+            margin_before = abs(net) * avg * acct.limits['margin_rate']
+            if net == 0 or (net > 0) == (signed > 0):
+                if net + signed:
+                    avg = (avg * abs(net) + price * abs(signed)) / abs(net + signed)
+            else:
+                closed = min(abs(net), abs(signed))
+                pnl = closed * (price - avg) * (1 if net > 0 else -1)
+                pos.realised += pnl
+                acct.realised += pnl
+                if abs(signed) > abs(net):
+                    avg = price
+            pos.quantity = net + signed
+            pos.avg_price = avg if pos.quantity else 0.0
+            acct.margin += abs(pos.quantity) * pos.avg_price * acct.limits['margin_rate'] - margin_before
+            holders = self.holders.setdefault(sym, [])
+            if pos.quantity and pos not in holders:
+                holders.append(pos)
+            self._mark(acct, pos, price if pos.last_price is None else pos.last_price)
+
+    def mark(self, symbol, ltp):
+        holders = self.holders.get(symbol)
+        if not holders:
+            return
+        ltp = float(ltp)
+        with self.lock:
+            for pos in holders:
+                self._mark(self.accounts[pos.account], pos, ltp)
+
+    def sync(self, symbol, quantity, avg_price, realised=0.0, account=None):
+        '''Replaces a position with the broker's figures, after a restart'''
+        acct = self._account(account)
+        sym = symbol.lower()
+        rate = acct.limits['margin_rate']
+        with self.lock:
+            pos = self._position(acct, sym)
+            acct.margin += (abs(quantity) * avg_price - abs(pos.quantity) * pos.avg_price) * rate
+            acct.realised += realised - pos.realised
+            pos.quantity = quantity
+            pos.avg_price = avg_price if quantity else 0.0
+            pos.realised = realised
+            holders = self.holders.setdefault(sym, [])
+            if quantity and pos not in holders:
+                holders.append(pos)
+            self._mark(acct, pos, avg_price if pos.last_price is None else pos.last_price)
+
+    def snapshot(self):
+        out = {}
+        with self.lock:
+            for name, acct in self.accounts.items():
+                out[name] = {'realised': acct.realised,
+                             'unrealised': acct.unrealised,
+                             'margin': acct.margin,
+                             'open_orders': len(acct.open_orders) + acct.reserved,
+                             'rejects': acct.rejects,
+                             'positions': {sym: {'quantity': p.quantity,
+                                                 'avg_price': p.avg_price,
+                                                 'realised': p.realised,
+                                                 'unrealised': p.unrealised}
+                                           for sym, p in acct.positions.items()
+                                           if p.quantity or p.realised}}
+        return out
+
+    def total(self, key):
+        return sum(getattr(acct, key) for acct in self.accounts.values())
+
+    def _account(self, name):
+        name = name or DEFAULT_ACCOUNT
+        acct = self.accounts.get(name)
+        if acct is None:
+            with self.lock:
+                acct = self.accounts.setdefault(name, AccountRisk(name, dict(self.defaults)))
+        return acct
+
+    def _position(self, acct, sym):
+        pos = acct.positions.get(sym)
+        if pos is None:
+            pos = acct.positions[sym] = Position(sym, acct.name)
+        return pos
+
+    def _mark(self, acct, pos, ltp):
+        pos.last_price = ltp
+        unrealised = pos.quantity * (ltp - pos.avg_price) if pos.quantity else 0.0
+        acct.unrealised += unrealised - pos.unrealised
+        pos.unrealised = unrealised
+
+    def _release(self, acct, sym, side):
+        queue = acct.pending.get((sym, side))
+        if not queue:
+            return (0, 0.0)
+        reserved = queue.popleft()
+        acct.reserved -= 1
+        if not queue:
+            del acct.pending[(sym, side)]
+        self._unreserve(acct, sym, side, reserved)
+        return reserved
+
+    def _reserve(self, acct, sym, side, reserved):
+        qty, margin = reserved
+        pos = self._position(acct, sym)
+        if side == BUY:
+            pos.pending_buy += qty
+        else:
+            pos.pending_sell += qty
+        acct.margin += margin
+
+    def _unreserve(self, acct, sym, side, reserved):
+        qty, margin = reserved
+        pos = self._position(acct, sym)
+        if side == BUY:
+            pos.pending_buy -= qty
+        else:
+            pos.pending_sell -= qty
+        acct.margin -= margin
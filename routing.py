@@ -0,0 +1,58 @@
+def normalize_symbols(symbols):
+    if symbols is None:
+        return ()
+    if isinstance(symbols, str):
+        return (symbols.lower(),)
+    return tuple(s.lower() for s in symbols if s is not None)
+
+
+class Router:
+    '''
+    Maps a lowercased symbol to the strategies subscribed to it.
+    The routes dict is swapped whole on rebuild so handler threads
+    can read it without locking.
+    '''
+    def __init__(self):
+        self.strategies = []
+        self.routes = {}
+        self._symbols = {}
+
+    def add(self, strategy):
+        self.strategies.append(strategy)
+        self.rebuild()
+
+    def remove(self, strategy):
+        self.strategies.remove(strategy)
+        self.rebuild()
+
+    def rebuild(self):
+        routes = {}
+        known = {}
+        for strategy in self.strategies:
+            syms = normalize_symbols(strategy.get_symbols())
+            known[id(strategy)] = syms
+            for sym in syms:
+                targets = routes.setdefault(sym, [])
+                if strategy not in targets:
+                    targets.append(strategy)
+        self._symbols = known
+        self.routes = routes
+
+    def refresh(self):
+        for strategy in self.strategies:
+            if normalize_symbols(strategy.get_symbols()) != self._symbols.get(id(strategy)):
+                self.rebuild()
+                return True
+        return False
+
+    def get(self, symbol):
+        return self.routes.get(symbol, ())
+
+    def symbols(self):
+        return list(self.routes)
+
+    def __contains__(self, symbol):
+        return symbol in self.routes
+
+    def __len__(self):
+        return len(self.routes)
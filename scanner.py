@@ -0,0 +1,195 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import numpy as np
+from upstox_api import api as upstox
+import vindicators as vi
+from emats import FAST_EMA, SLOW_EMA
+from streaming import Crossover as EMACrossover
+from ohlcstore import OHLCStore
+from bars import interval_name
+from utils import create_logger
+
+EXCHANGES = ('nse_fo', 'nse_index')
+LOOKBACK_DAYS = 120
+WORKERS = 8
+FRESH_BARS = 1
+
+Signal = namedtuple('Signal', ['symbol', 'direction', 'timestamp', 'bar', 'strength', 'instrument'])
+
+
+class CrossoverScanner:
+    '''
+    Runs the EMATS fast/slow EMA crossover over every instrument in the
+    loaded master contracts. setup() pulls history through OHLCStore on a
+    bounded pool and computes the whole universe at once with vindicators,
+    then leaves one streaming Crossover per instrument so each closed bar
+    passed to on_bar() is a constant time update.
+
+    Subscribers get on_scan(ranked) once setup() has scanned the history
+    and again for each batch of bar closes that produced a crossover. The
+    Manager calls flush() once it has drained the closed bars, and a bar
+    from the next period flushes anything still pending. ranked holds the
+    crossovers from the last fresh_bars bars, newest first and then by
+    how far fast has moved away from slow.
+    '''
+    def __init__(self, fast=FAST_EMA, slow=SLOW_EMA, interval=upstox.OHLCInterval.Day_1,
+                 exchanges=EXCHANGES, lookback=LOOKBACK_DAYS, fresh_bars=FRESH_BARS,
+                 workers=WORKERS, store=None):
+        self.logger = create_logger(self.__class__.__name__)
+        self.fast = fast
+        self.slow = slow
+        self.interval = interval
+        name = interval_name(interval)
+        self.bar_intervals = (name,) if name else ()
+        self.exchanges = exchanges
+        self.lookback = lookback
+        self.fresh_bars = fresh_bars
+        self.workers = workers
+        self.store = store
+        self.instruments = {}
+        self.crossovers = {}
+        self.counts = {}
+        self.last_ts = {}
+        self.signals = {}
+        self.subscribers = []
+        self.pending = None
+        self.ready = False
+
+    def subscribe(self, strategy):
+        self.subscribers.append(strategy)
+
+    def unsubscribe(self, strategy):
+        self.subscribers.remove(strategy)
+
+    def universe(self, client):
+        insts = []
+        for exchange in self.exchanges:
+            contracts = upstox.master_contracts_by_symbol.get(exchange)
+            if contracts:
+                insts.extend(contracts.values())
+        return insts
+
+    def setup(self, client=None):
+        if self.store is None:
+            self.store = OHLCStore()
+        insts = self.universe(client)
+        todt = (datetime.today() - timedelta(days=1)).date()
+        fromdt = todt - timedelta(days=self.lookback)
+        self.logger.info('Loading %d instruments of history' % len(insts))
+        history = self.store.warm(client, insts, self.interval, fromdt, todt, self.workers)
+        self.load(insts, history)
+
+    def load(self, instruments, history):
+        '''history maps a lowercased symbol to its bars, oldest first'''
+        syms = []
+        series = []
+        for inst in instruments:
+            sym = inst.symbol.lower()
+            bars = history.get(sym) or []
+            self.instruments[sym] = inst
+            self.crossovers[sym] = EMACrossover(self.fast, self.slow)
+            self.counts[sym] = 0
+            if bars:
+                syms.append(sym)
+                series.append(bars)
+        if syms:
+            self._load_batch(syms, series)
+        self.ready = True
+        fresh = self.ranked()
+        self.logger.info('Scanned %d instruments, %d with history, %d fresh crossovers' %
+                         (len(self.instruments), len(syms), len(fresh)))
+        self._publish(fresh)
+
+    def _load_batch(self, syms, series):
+        close = vi.stack([vi.closes(bars) for bars in series])
+        fast = vi.stream_ema(close, self.fast)
+        slow = vi.stream_ema(close, self.slow)
+        crosses = vi.crossovers(fast, slow)
+        lengths = np.array([len(bars) for bars in series])
+        for row, sym in enumerate(syms):
+            n = int(lengths[row])
+            bars = series[row]
+            self.counts[sym] = n
+            self.last_ts[sym] = int(bars[-1]['timestamp'])
+            if n < self.slow:
+                # too short for the batch values to mean anything, replay it
+                for bar in bars:
+                    self.crossovers[sym].update(float(bar['close']))
+                continue
+            hit = np.flatnonzero(crosses[row, :n])
+            last = None
+            if len(hit):
+                i = int(hit[-1])
+                last = 'up' if crosses[row, i] > 0 else 'down'
+                self.signals[sym] = self._signal(sym, last, int(bars[i]['timestamp']), i + 1,
+                                                 float(fast[row, i]), float(slow[row, i]))
+                if i != n - 1:
+                    last = None
+            head = close[row, :self.slow]
+            fv, sv = float(fast[row, n - 1]), float(slow[row, n - 1])
+            self.crossovers[sym].restore(((self.fast, fv, n, _sum(head[:self.fast])),
+                                          (self.slow, sv, n, _sum(head)),
+                                          fv, sv, last))
+
+    def on_bar(self, bar):
+        sym = bar['symbol'].lower()
+        cross = self.crossovers.get(sym)
+        ts = int(bar['timestamp'])
+        if cross is None or ts <= self.last_ts.get(sym, -1):
+            return None
+        if self.pending is not None and ts > self.pending:
+            self.flush()
+        self.last_ts[sym] = ts
+        self.counts[sym] += 1
+        direction = cross.update(float(bar['close']))
+        if direction is None:
+            return None
+        self.signals[sym] = self._signal(sym, direction, ts, self.counts[sym],
+                                         cross.fast.value, cross.slow.value)
+        self.pending = max(ts, self.pending or ts)
+        return direction
+
+    def flush(self):
+        if self.pending is None:
+            return
+        self.pending = None
+        self._publish(self.ranked())
+
+    def _publish(self, ranked):
+        for strategy in self.subscribers:
+            try:
+                strategy.on_scan(ranked)
+            except Exception as e:
+                self.logger.exception('Subscriber failed on scan update')
+
+    def ranked(self):
+        fresh = [s for s in self.signals.values()
+                 if self.counts[s.symbol] - s.bar < self.fresh_bars]
+        fresh.sort(key=lambda s: (self.counts[s.symbol] - s.bar, -s.strength))
+        return fresh
+
+    def process_quote(self, quote):
+        return None
+
+    def process_order(self, order):
+        pass
+
+    def process_trade(self, trade):
+        pass
+
+    def get_symbols(self):
+        if not self.ready:
+            return None
+        return list(self.instruments)
+
+    def _signal(self, sym, direction, ts, bar, fast, slow):
+        strength = abs(fast - slow) / slow if slow else 0.0
+        return Signal(sym, direction, ts, bar, float(strength), self.instruments[sym])
+
+
+def _sum(values):
+    # same summation order as streaming.EMA builds its seed
+    total = 0.0
+    for v in values:
+        total += v
+    return float(total)
@@ -0,0 +1,171 @@
+from functools import partial
+from upstox_api import api
+from urllib3.exceptions import MaxRetryError
+from routing import Router
+from gateway import OrderGateway
+from utils import create_logger
+
+MAX_LOGIN_TRIES = 10
+DEFAULT_ACCOUNT = 'default'
+DEFAULT_SECTION = 'userinfo'
+ACCOUNT_PREFIX = 'account:'
+
+
+def login(creds, logger):
+    '''
+    Logs in with one [userinfo]-style config section, asking for the
+    key, secret and auth code on the console when they are missing.
+    Returns the client or None.
+    '''
+    if creds['key'] == '0':
+        creds['key'] = input('Please enter the API key - ')
+        logger.debug('Received new API key')
+    if creds['secret'] == '0':
+        creds['secret'] = input('Please enter the API secret - ')
+        logger.debug('Received new API secret')
+
+    client = None
+    tries = 0
+    s = api.Session(creds['key'])
+    s.set_redirect_uri('http://127.0.0.1')
+    s.set_api_secret(creds['secret'])
+    while tries < MAX_LOGIN_TRIES:
+        try:
+            client = api.Upstox(creds['key'], creds['token'])
+            logger.info('Logged in successfully.')
+            break
+        except MaxRetryError:
+            logger.exception('Unable to login- check internet connection')
+        except Exception as e:
+            if 'Invalid Bearer token' in e.args[0]:
+                url = s.get_login_url()
+                print('New token required. Auth url - ')
+                print(url)
+                code = input("Please enter the code from the login page - ")
+                s.set_code(code)
+                creds['token'] = s.retrieve_access_token()
+                logger.info('Received new upstox auth token')
+        tries += 1
+    return client
+
+
+def account_sections(config):
+    return [s for s in config.sections() if s.startswith(ACCOUNT_PREFIX)]
+
+
+class Account:
+    '''
+    One authenticated client with its own order gateway and the
+    strategies trading through it.
+    '''
+    def __init__(self, name, on_ack):
+        self.name = name
+        self.client = None
+        self.router = Router()
+        self.gateway = OrderGateway(on_ack, account=name)
+
+
+class SessionPool:
+    '''
+    Holds every account the Manager trades through. Only the feed client
+    (the default account) subscribes to market data, the others share its
+    master contract cache and keep a websocket open just for their own
+    order and trade updates, so N accounts still cost one feed.
+    '''
+    def __init__(self, on_ack):
+        self.logger = create_logger(self.__class__.__name__)
+        self.on_ack = on_ack
+        self.accounts = {}
+        self.owners = {}
+        self.feed = None
+        self.default = self.accounts[DEFAULT_ACCOUNT] = Account(DEFAULT_ACCOUNT, on_ack)
+
+    def get(self, name=None):
+        '''Raises KeyError for an account that was never attached'''
+        account = self.accounts.get(name or DEFAULT_ACCOUNT)
+        if account is None:
+            raise KeyError('Unknown account %s' % name)
+        return account
+
+    def attach(self, name, client, on_order=None, on_trade=None):
+        account = self.accounts.get(name)
+        if account is None:
+            account = self.accounts[name] = Account(name, self.on_ack)
+        account.client = client
+        if name == DEFAULT_ACCOUNT:
+            self.feed = client
+            return account
+        if self.feed is not None:
+            self.share_cache(client)
+        if on_order is not None:
+            client.set_on_order_update(partial(on_order, account=name))
+        if on_trade is not None:
+            client.set_on_trade_update(partial(on_trade, account=name))
+        client.set_on_quote_update(self._ignore_quote)
+        client.set_on_disconnect(partial(self._reconnect, name))
+        return account
+
+    def share_cache(self, client):
+        # contracts are module level in upstox_api, only the exchange list is per client
+        client.enabled_exchanges = self.feed.enabled_exchanges
+
+    def assign(self, strategy, name=None):
+        account = self.get(name)
+        account.router.add(strategy)
+        self.owners[id(strategy)] = account.name
+        return account
+
+    def owner(self, strategy):
+        return self.owners.get(id(strategy), DEFAULT_ACCOUNT)
+
+    def route(self, name, symbol):
+        return self.get(name).router.get(symbol)
+
+    def submit(self, order, name=None):
+        self.get(name).gateway.submit(order)
+
+    def refresh(self):
+        changed = False
+        for account in self.accounts.values():
+            changed = account.router.refresh() or changed
+        return changed
+
+    def rebuild(self):
+        for account in self.accounts.values():
+            account.router.rebuild()
+
+    def pending(self):
+        return sum(a.gateway.pending() for a in self.accounts.values())
+
+    def start(self, feed):
+        if self.default.client is None:
+            self.attach(DEFAULT_ACCOUNT, feed)
+        for account in self.accounts.values():
+            if account.client is None:
+                continue
+            account.gateway.start(account.client)
+            if account.client is not self.feed:
+                account.client.start_websocket(True)
+
+    def stop(self):
+        for account in self.accounts.values():
+            account.gateway.stop()
+            if account.client is None or account.client is self.feed:
+                continue
+            ws = getattr(account.client, 'websocket', None)
+            if ws is not None:
+                ws.keep_running = False
+
+    def _ignore_quote(self, message):
+        pass
+
+    def _reconnect(self, name, message):
+        account = self.accounts[name]
+        ws = getattr(account.client, 'websocket', None)
+        if ws is None or not account.gateway.running:
+            return
+        self.logger.info('Order websocket for %s disconnected, restarting' % name)
+        try:
+            account.client.start_websocket(True)
+        except Exception as e:
+            self.logger.exception('Could not restart order websocket for %s' % name)
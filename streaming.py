@@ -0,0 +1,132 @@
+class EMA:
+    '''
+    Exponential moving average updated one close at a time. Seeded with
+    the SMA of the first n values, value stays None until then.
+    '''
+    __slots__ = ('n', 'c', 'value', 'count', 'seed')
+
+    def __init__(self, n):
+        self.n = n
+        self.c = 2 / float(n + 1)
+        self.value = None
+        self.count = 0
+        self.seed = 0.0
+
+    @property
+    def ready(self):
+        return self.value is not None
+
+    def update(self, price):
+        self.count += 1
+        if self.value is None:
+            self.seed += price
+            if self.count == self.n:
+                self.value = self.seed / self.n
+            return self.value
+        self.value = price * self.c + self.value * (1 - self.c)
+        return self.value
+
+    def peek(self, price):
+        if self.value is None:
+            return None
+        return price * self.c + self.value * (1 - self.c)
+
+    def snapshot(self):
+        return (self.n, self.value, self.count, self.seed)
+
+    def restore(self, state):
+        n, self.value, self.count, self.seed = state
+        if n != self.n:
+            self.n = n
+            self.c = 2 / float(n + 1)
+
+
+class SMA:
+    __slots__ = ('n', 'window', 'pos', 'total', 'count')
+
+    def __init__(self, n):
+        self.n = n
+        self.window = [0.0] * n
+        self.pos = 0
+        self.total = 0.0
+        self.count = 0
+
+    @property
+    def ready(self):
+        return self.count >= self.n
+
+    @property
+    def value(self):
+        if self.count < self.n:
+            return None
+        return self.total / self.n
+
+    def update(self, price):
+        self.total += price - self.window[self.pos]
+        self.window[self.pos] = price
+        self.pos = (self.pos + 1) % self.n
+        self.count += 1
+        return self.value
+
+    def peek(self, price):
+        if self.count < self.n:
+            return None
+        return (self.total + price - self.window[self.pos]) / self.n
+
+    def snapshot(self):
+        return (self.n, list(self.window), self.pos, self.total, self.count)
+
+    def restore(self, state):
+        self.n, window, self.pos, self.total, self.count = state
+        self.window = list(window)
+
+
+def crossover(fast_prev, fast, slow_prev, slow):
+    if fast_prev < slow_prev and fast > slow:
+        return 'up'
+    elif fast_prev > slow_prev and fast < slow:
+        return 'down'
+    return None
+
+
+class Crossover:
+    '''
+    Tracks a fast and slow average over the same closes. update() commits
+    a closed bar and returns 'up', 'down' or None, peek() answers the same
+    question for a bar that is still forming without changing state.
+    '''
+    __slots__ = ('fast', 'slow', 'prev_fast', 'prev_slow', 'last')
+
+    def __init__(self, fast_n, slow_n, average=EMA):
+        self.fast = average(fast_n)
+        self.slow = average(slow_n)
+        self.prev_fast = None
+        self.prev_slow = None
+        self.last = None
+
+    def update(self, price):
+        fast = self.fast.update(price)
+        slow = self.slow.update(price)
+        cross = None
+        if self.prev_fast is not None and fast is not None and slow is not None:
+            cross = crossover(self.prev_fast, fast, self.prev_slow, slow)
+        if slow is not None:
+            self.prev_fast = fast
+            self.prev_slow = slow
+        self.last = cross
+        return cross
+
+    def peek(self, price):
+        if self.prev_fast is None:
+            return None
+        return crossover(self.prev_fast, self.fast.peek(price),
+                         self.prev_slow, self.slow.peek(price))
+
+    def snapshot(self):
+        return (self.fast.snapshot(), self.slow.snapshot(),
+                self.prev_fast, self.prev_slow, self.last)
+
+    def restore(self, state):
+        fast, slow, self.prev_fast, self.prev_slow, self.last = state
+        self.fast.restore(fast)
+        self.slow.restore(slow)
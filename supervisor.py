@@ -0,0 +1,218 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+from time import sleep, perf_counter
+from upstox_api import api
+from utils import create_logger
+
+CONNECTED = 'connected'
+RECONNECTING = 'reconnecting'
+STOPPED = 'stopped'
+
+BACKOFF = 0.05
+MAX_BACKOFF = 5.0
+STALE_MIN = 2.0
+STALE_FACTOR = 10
+# the whole feed must be silent this long, after ticking since the last connect
+FEED_TIMEOUT = 10
+RESUBSCRIBE_INTERVAL = 30
+RESUBSCRIBE_BATCH = 50
+SNAPSHOT_WORKERS = 8
+
+
+class FeedSupervisor:
+    '''
+    Keeps the websocket feed alive for a set of instruments.
+
+    stopped -> connected on start(), connected -> reconnecting on the
+    disconnect callback or when a feed that was ticking has gone silent
+    for FEED_TIMEOUT, reconnecting -> connected once the socket is
+    restarted, every instrument is resubscribed in bulk and the gap is
+    filled with a REST snapshot. Reconnect attempts back off
+    exponentially with jitter.
+
+    Staleness is judged per instrument against its own tick rate, so a
+    quiet strike only gets resubscribed and refreshed on its own. A feed
+    of nothing but illiquid strikes never ticked since it connected, so
+    it is resubscribed rather than reconnected over and over. Stale
+    instruments are refreshed off the caller's thread, at most
+    RESUBSCRIBE_BATCH per check. Snapshots go to on_snapshot, they are
+    last known prices, not new ticks.
+    '''
+    def __init__(self, on_snapshot):
+        self.logger = create_logger(self.__class__.__name__)
+        self.client = None
+        self.on_snapshot = on_snapshot
+        self.state = STOPPED
+        self.lock = Lock()
+        self.instruments = {}
+        self.last_seen = {}
+        self.interval = {}
+        self.resubscribed = {}
+        self.refreshing = False
+        self.ticks = 0
+        self.last_tick = None
+        self.reconnects = 0
+        self.resumed_in = None
+
+    def track(self, instruments):
+        new = []
+        with self.lock:
+            for inst in instruments:
+                sym = inst.symbol.lower()
+                if sym not in self.instruments:
+                    # stale if it never ticks, not just once it has
+                    self.last_seen[sym] = perf_counter()
+                    self.instruments[sym] = inst
+                    new.append(inst)
+        if new and self.state == CONNECTED:
+            self._subscribe(new)
+        return new
+
+    def start(self, client):
+        self.client = client
+        self._subscribe(list(self.instruments.values()))
+        self.client.start_websocket(True)
+        self._reset_clock()
+        self.state = CONNECTED
+
+    def stop(self):
+        self.state = STOPPED
+        self._close_socket()
+
+    def heartbeat(self, sym):
+        now = perf_counter()
+        prev = self.last_seen.get(sym)
+        if prev is not None:
+            gap = now - prev
+            avg = self.interval.get(sym)
+            self.interval[sym] = gap if avg is None else avg * 0.9 + gap * 0.1
+        self.last_seen[sym] = now
+        self.last_tick = now
+        self.ticks += 1
+
+    def on_disconnect(self):
+        self._begin_reconnect('disconnect callback')
+
+    def check(self):
+        if self.state != CONNECTED or not self.instruments:
+            return
+        now = perf_counter()
+        stale = []
+        for sym, inst in list(self.instruments.items()):
+            avg = self.interval.get(sym)
+            limit = STALE_MIN if avg is None else max(STALE_MIN, avg * STALE_FACTOR)
+            if now - self.last_seen[sym] > limit:
+                stale.append(inst)
+        if not stale:
+            return
+        if len(stale) == len(self.instruments) and self.ticks and \
+                now - self.last_tick > FEED_TIMEOUT:
+            self._begin_reconnect('no ticks for %.0fs' % (now - self.last_tick))
+            return
+        if self.refreshing:
+            return
+        due = [i for i in stale
+               if now - self.resubscribed.get(i.symbol.lower(), 0) > RESUBSCRIBE_INTERVAL]
+        due = due[:RESUBSCRIBE_BATCH]
+        if due:
+            self.logger.debug('Resubscribing %d stale instruments' % len(due))
+            for inst in due:
+                self.resubscribed[inst.symbol.lower()] = now
+            self.refreshing = True
+            Thread(target=self._refresh, args=(due,), name='feed-refresh', daemon=True).start()
+
+    def _refresh(self, instruments):
+        try:
+            self._subscribe(instruments)
+            self._snapshot(instruments)
+        finally:
+            self.refreshing = False
+
+    def _begin_reconnect(self, reason):
+        with self.lock:
+            if self.state != CONNECTED:
+                return
+            self.state = RECONNECTING
+        self.logger.info('Reconnecting websocket - %s' % reason)
+        Thread(target=self._reconnect, name='feed-reconnect', daemon=True).start()
+
+    def _reconnect(self):
+        started = perf_counter()
+        attempt = 0
+        delay = BACKOFF
+        while self.state == RECONNECTING:
+            if attempt:
+                sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, MAX_BACKOFF)
+            attempt += 1
+            try:
+                self._close_socket()
+                self.client.start_websocket(True)
+                self._subscribe(list(self.instruments.values()))
+            except Exception as e:
+                self.logger.exception('Reconnect attempt %d failed' % attempt)
+                continue
+            self._reset_clock()
+            with self.lock:
+                if self.state == RECONNECTING:
+                    self.state = CONNECTED
+            self.reconnects += 1
+            self.resumed_in = perf_counter() - started
+            self.logger.info('Feed resumed after %.3fs, %d attempts' % (self.resumed_in, attempt))
+            self._snapshot(list(self.instruments.values()))
+            return
+
+    def _reset_clock(self):
+        # staleness and the tick count start over with each connection
+        now = perf_counter()
+        for sym in list(self.instruments):
+            self.last_seen[sym] = now
+        self.last_tick = now
+        self.ticks = 0
+
+    def _close_socket(self):
+        ws = getattr(self.client, 'websocket', None)
+        if ws is None:
+            return
+        ws.keep_running = False
+        try:
+            ws.close()
+        except Exception as e:
+            pass
+
+    def _subscribe(self, instruments):
+        by_exchange = {}
+        for inst in instruments:
+            by_exchange.setdefault(inst.exchange.lower(), []).append(inst)
+        for exchange, insts in by_exchange.items():
+            self._subscribe_exchange(exchange, insts)
+
+    def _subscribe_exchange(self, exchange, instruments):
+        # list subscribes need upstox_api 2.x, older clients take one instrument per call
+        try:
+            if self.client.subscribe(instruments, api.LiveFeedType.LTP,
+                                     exchange=exchange).get('success'):
+                return
+        except Exception as e:
+            self.logger.debug('Bulk subscribe failed, subscribing one by one')
+        for inst in instruments:
+            try:
+                self.client.subscribe(inst, api.LiveFeedType.LTP)
+            except Exception as e:
+                self.logger.exception('Could not subscribe to %s' % inst.symbol)
+
+    def _snapshot(self, instruments):
+        def fetch(inst):
+            try:
+                feed = self.client.get_live_feed(inst, api.LiveFeedType.LTP)
+            except Exception as e:
+                return None
+            feed['instrument'] = inst
+            feed['snapshot'] = True
+            return feed
+
+        with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as pool:
+            for feed in pool.map(fetch, instruments):
+                if feed is not None:
+                    self.on_snapshot(feed)
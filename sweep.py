@@ -0,0 +1,263 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import perf_counter
+from backtest import ReplayEngine, make_instrument, ticks_from_reader, merge_ticks
+from recorder import TickReader, list_instruments, instrument_dir, TICK_DIR
+from utils import create_logger
+
+RESULTS_DIR = 'sweep_results'
+CHUNK = 8
+TOP = 20
+UNDERLYING = ('nse_index', 'nifty_50')
+OPTION_RE = re.compile(r'(\d+)(ce|pe)$')
+QUIET = ('GannBot', 'GannNiftyOptions', 'EMATS', 'ReplayEngine')
+
+# values to try per parameter, random search samples from the same lists
+SPACES = {'gannbot': {'buy': [2, 3, 4, 5, 6, 7],
+                      'target': [-1, -2, -3, -4],
+                      'stoploss': [2, 3, 4, 5, 6, 7, 8]},
+          'emats': {'fast': [2, 3, 4, 5, 8],
+                    'slow': [5, 8, 10, 13, 21, 34],
+                    'bar_seconds': [60, 300, 900]},
+          'niftyoptions': {'strike_band': [200, 300, 400, 500, 600],
+                           'max_cycles': [1, 2, 3, 4],
+                           'buy': [3, 4, 5],
+                           'stoploss': [4, 5, 6]}}
+
+
+def grid(space):
+    names = sorted(space)
+    for values in itertools.product(*(space[n] for n in names)):
+        yield dict(zip(names, values))
+
+
+def sample(space, n, seed=0):
+    rnd = random.Random(seed)
+    names = sorted(space)
+    seen = set()
+    total = 1
+    for name in names:
+        total *= len(space[name])
+    while len(seen) < min(n, total):
+        values = tuple(rnd.choice(space[name]) for name in names)
+        if values not in seen:
+            seen.add(values)
+            yield dict(zip(names, values))
+
+
+# per process market data, opened once by _init_worker and shared
+# read only with every other worker through the page cache
+_data = {}
+
+
+def _init_worker(day, root, instruments):
+    for name in QUIET:
+        create_logger(name).setLevel(logging.WARNING)
+    _data['day'] = day
+    _data['readers'] = {key: TickReader(instrument_dir(root, day, *key)) for key in instruments}
+    _data['instruments'] = {key: make_instrument(key[1], key[0]) for key in instruments}
+
+
+def _ticks(keys):
+    readers = _data['readers']
+    insts = _data['instruments']
+    return merge_ticks(*(ticks_from_reader(readers[k], insts[k]) for k in keys))
+
+
+def _first_ltp(key):
+    ltp = _data['readers'][key]['ltp']
+    return ltp[0] if len(ltp) else None
+
+
+def option_legs(keys, band):
+    '''
+    Offline stand in for GannNiftyOptions.setup - cheapest call in
+    base..base+band and put in base-band..base, base from the first
+    recorded NIFTY 50 ltp, first recorded ltp in place of the close.
+    '''
+    spot = _first_ltp(UNDERLYING) if UNDERLYING in keys else None
+    legs = {}
+    for key in keys:
+        m = OPTION_RE.search(key[1])
+        if key[0] != 'nse_fo' or m is None:
+            continue
+        strike, kind = int(m.group(1)), m.group(2)
+        if spot is not None:
+            base = int(spot / 100) * 100
+            lo, hi = (base, base + band) if kind == 'ce' else (base - band, base)
+            if not lo <= strike < hi:
+                continue
+        ltp = _first_ltp(key)
+        if ltp is None:
+            continue
+        if kind not in legs or ltp < legs[kind][1]:
+            legs[kind] = (key, ltp)
+    return legs.get('ce', (None,))[0], legs.get('pe', (None,))[0]
+
+
+def run_gannbot(params):
+    from gannbot import GannBot
+    keys = [k for k in _data['readers'] if k != UNDERLYING]
+    engine = ReplayEngine()
+    for key in keys:
+        engine.add_strategy(GannBot(params=params), (key[1],))
+    return engine.run(_ticks(keys))
+
+
+def run_niftyoptions(params):
+    from niftyoptions import GannNiftyOptions
+    from models import State
+    ce, pe = option_legs(list(_data['readers']), params['strike_band'])
+    if ce is None or pe is None:
+        return None
+    levels = {k: params[k] for k in ('buy', 'target', 'stoploss') if k in params}
+    o = GannNiftyOptions(strike_band=params['strike_band'],
+                         max_cycles=params['max_cycles'], params=levels)
+    o.ce_symbol, o.pe_symbol = ce[1], pe[1]
+    o.state |= State.SETUP
+    engine = ReplayEngine()
+    engine.add_strategy(o)
+    return engine.run(_ticks([ce, pe]))
+
+
+def run_emats(params):
+    '''
+    EMATS only signals, so it is scored as long on an up crossover and
+    flat on a down one over bars of bar_seconds built from the ticks.
+    '''
+    from emats import EMATS
+    if params['fast'] >= params['slow']:
+        return None
+    results = {'ticks': 0, 'orders': 0, 'trades': 0, 'realised': 0.0,
+               'unrealised': 0.0, 'positions': {}}
+    for key in _data['readers']:
+        e = EMATS(fast=params['fast'], slow=params['slow'])
+        entry = None
+        last = None
+        for bar in _bars(key, params['bar_seconds'] * 1000):
+            last = bar['close']
+            cross = e.on_bar(bar)
+            if cross == 'up' and entry is None:
+                entry = last
+                results['orders'] += 1
+            elif cross == 'down' and entry is not None:
+                results['realised'] += last - entry
+                results['trades'] += 1
+                results['orders'] += 1
+                entry = None
+        results['ticks'] += len(_data['readers'][key])
+        if entry is not None:
+            results['unrealised'] += last - entry
+            results['positions'][key[1]] = 1
+    return results
+
+
+def _bars(key, width):
+    reader = _data['readers'][key]
+    bar = None
+    for ts, ltp in zip(reader['timestamp'], reader['ltp']):
+        start = ts - ts % width
+        if bar is None or bar['timestamp'] != start:
+            if bar is not None:
+                yield bar
+            bar = {'timestamp': start, 'open': ltp, 'high': ltp, 'low': ltp, 'close': ltp}
+        else:
+            bar['high'] = max(bar['high'], ltp)
+            bar['low'] = min(bar['low'], ltp)
+            bar['close'] = ltp
+    if bar is not None:
+        yield bar
+
+
+RUNNERS = {'gannbot': run_gannbot,
+           'emats': run_emats,
+           'niftyoptions': run_niftyoptions}
+
+
+def _run_config(strategy, params):
+    start = perf_counter()
+    try:
+        r = RUNNERS[strategy](params)
+    except Exception as e:
+        create_logger('sweep').exception('Run failed for %s' % params)
+        return None
+    if r is None:
+        return None
+    r['params'] = params
+    r['pnl'] = r['realised'] + r['unrealised']
+    r['seconds'] = perf_counter() - start
+    return r
+
+
+def _run_chunk(strategy, configs):
+    return [_run_config(strategy, params) for params in configs]
+
+
+def rank(results, key='pnl'):
+    '''Best first, fewer orders wins a tie'''
+    return sorted((r for r in results if r is not None),
+                  key=lambda r: (-r[key], r['orders']))
+
+
+def sweep(strategy, configs, day, root=TICK_DIR, instruments=None, workers=None,
+          chunk=CHUNK):
+    '''
+    Replays one recorded day for every config on a process pool. Each
+    worker maps the day's column files once, configs go out in chunks.
+    '''
+    if instruments is None:
+        instruments = list_instruments(day, root)
+    if not instruments:
+        raise ValueError('No recorded ticks for %s under %s' % (day, root))
+    configs = list(configs)
+    chunks = [configs[i:i + chunk] for i in range(0, len(configs), chunk)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(day, root, instruments)) as pool:
+        futures = [pool.submit(_run_chunk, strategy, c) for c in chunks]
+        for f in futures:
+            results.extend(f.result())
+    return rank(results)
+
+
+def save(strategy, day, ranked, directory=RESULTS_DIR):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    name = '%s-%s-%s.json' % (strategy, day, datetime.now().strftime('%Y%m%d-%H%M%S'))
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        json.dump(ranked, f, indent=2)
+    return path
+
+
+def report(ranked, top=TOP):
+    for i, r in enumerate(ranked[:top]):
+        params = ' '.join('%s=%s' % kv for kv in sorted(r['params'].items()))
+        print('%3d  pnl %10.2f | realised %10.2f | orders %5d | trades %5d | %s' %
+              (i + 1, r['pnl'], r['realised'], r['orders'], r['trades'], params))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Strategy parameter sweep over recorded ticks')
+    parser.add_argument('strategy', choices=sorted(RUNNERS))
+    parser.add_argument('day', help='recorded day, dd-mm-YYYY')
+    parser.add_argument('--root', default=TICK_DIR)
+    parser.add_argument('--samples', type=int, help='random search with this many configs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--top', type=int, default=TOP)
+    args = parser.parse_args()
+    space = SPACES[args.strategy]
+    configs = grid(space) if args.samples is None else sample(space, args.samples, args.seed)
+    start = perf_counter()
+    ranked = sweep(args.strategy, configs, args.day, args.root, workers=args.workers)
+    print('%d configs in %.1fs' % (len(ranked), perf_counter() - start))
+    report(ranked, args.top)
+    print('Saved %s' % save(args.strategy, args.day, ranked))
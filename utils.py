@@ -1,4 +1,9 @@
 from datetime import datetime, date
+from queue import Queue, Empty
+from threading import Thread, Lock
+from logging.handlers import QueueHandler
+import atexit
+import json
 import logging
 import os
 
@@ -67,23 +72,147 @@ def get_expiry_dates(month=1):
     return dates
 
 
-def create_logger(name, console=False, level=logging.INFO):
+LOG_BATCH = 512
+LOG_FLUSH_INTERVAL = 0.5
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'ts': record.created,
+                 'level': record.levelname,
+                 'name': record.name,
+                 'thread': record.threadName,
+                 'msg': record.getMessage()}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class DeferredQueueHandler(QueueHandler):
+    '''
+    Hands the record to the log writer as is, so message formatting
+    happens on the writer thread instead of the caller's.
+    '''
+    def prepare(self, record):
+        return record
+
+
+class BatchedStreamHandler(logging.StreamHandler):
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class BatchedFileHandler(logging.FileHandler):
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class LogWriter(Thread):
+    '''
+    Drains the shared log queue in batches, writes each record to the
+    handlers registered for its logger and flushes once per batch.
+    '''
+    def __init__(self, queue):
+        super().__init__(name='log-writer', daemon=True)
+        self.queue = queue
+        self.targets = {}
+        self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=LOG_FLUSH_INTERVAL)]
+            except Empty:
+                continue
+            while len(batch) < LOG_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            used = set()
+            for record in batch:
+                if record is None:
+                    self._flush(used)
+                    return
+                for handler in self.targets.get(record.name, ()):
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+                        used.add(handler)
+            self._flush(used)
+
+    def stop(self):
+        self.queue.put(None)
+        self.join(LOG_FLUSH_INTERVAL * 4)
+
+    def _flush(self, handlers):
+        for handler in handlers:
+            handler.flush()
+
+
+_log_queue = Queue()
+_log_writer = None
+_log_lock = Lock()
+
+
+def _get_log_writer():
+    global _log_writer
+    with _log_lock:
+        # a forked child inherits the registry but not the writer thread
+        if _log_writer is None or _log_writer.pid != os.getpid():
+            targets = _log_writer.targets if _log_writer is not None else {}
+            _log_writer = LogWriter(_log_queue)
+            _log_writer.targets = targets
+            _log_writer.start()
+            atexit.register(_log_writer.stop)
+        return _log_writer
+
+
+def create_logger(name, console=False, level=logging.INFO, structured=False):
+    writer = _get_log_writer()
+    logger = logging.getLogger(name)
+    targets = writer.targets.get(name)
+    if targets is not None:
+        if console and not any(isinstance(h, BatchedStreamHandler) for h in targets):
+            targets.append(_console_handler(level))
+        return logger
+
     log_dir = os.path.join(os.getcwd(), 'logs')
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    name = name + date.today().strftime(' %m-%d-%Y') + '.log'
-    fmt = logging.Formatter('[{asctime} - {levelname}] {name} - {message}',
-                            datefmt='%H:%M:%S',
-                            style='{')
+    # a level set before the logger was first created, e.g. to quiet it, wins
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.DEBUG)
+    ext = '.jsonl' if structured else '.log'
+    fname = name + date.today().strftime(' %m-%d-%Y') + ext
+    targets = []
     if console:
-        ch = logging.StreamHandler()
-        ch.setFormatter(fmt)
-        ch.setLevel(level)
-        logger.addHandler(ch)
-    fh = logging.FileHandler(os.path.join(log_dir, name))
-    fh.setFormatter(fmt)
+        targets.append(_console_handler(level))
+    fh = BatchedFileHandler(os.path.join(log_dir, fname))
+    fh.setFormatter(JsonFormatter() if structured else _log_format())
     fh.setLevel(logging.DEBUG)
-    logger.addHandler(fh)
+    targets.append(fh)
+    writer.targets[name] = targets
+    logger.addHandler(DeferredQueueHandler(_log_queue))
     return logger
+
+
+def _log_format():
+    return logging.Formatter('[{asctime} - {levelname}] {name} - {message}',
+                             datefmt='%H:%M:%S',
+                             style='{')
+
+
+def _console_handler(level):
+    ch = BatchedStreamHandler()
+    ch.setFormatter(_log_format())
+    ch.setLevel(level)
+    return ch
+
@@ -0,0 +1,125 @@
+import numpy as np
+from indicators import GANN_ANGLES
+
+NAN = float('nan')
+
+
+def closes(ohlc_arr, key='close'):
+    '''ohlc_arr is a list of dicts like indicators.ema takes, sorted by timestamp'''
+    return np.fromiter((float(o[key]) for o in ohlc_arr), dtype=np.float64,
+                       count=len(ohlc_arr))
+
+
+def stack(series):
+    '''
+    Stacks per-symbol close arrays into one (symbols, bars) array,
+    shorter series are padded with nan at the end.
+    '''
+    width = max(len(s) for s in series)
+    out = np.full((len(series), width), NAN)
+    for i, s in enumerate(series):
+        out[i, :len(s)] = s
+    return out
+
+
+def ema(close, n=3, seed='sma'):
+    '''
+    out[..., i] equals indicators.ema(bars[:i + 1], n, seed) for every i,
+    nan where there are fewer than n + 1 bars. The recurrence runs in the
+    same order as the scalar loop so the results are bit for bit equal.
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(close.shape, NAN)
+    length = close.shape[-1]
+    if length < n + 1:
+        return out
+    c = 2 / float(n + 1)
+    if seed == 'sma':
+        counts = np.arange(1, length - n + 1, dtype=np.float64)
+        prev = np.cumsum(close[..., :length - n], axis=-1) / counts
+    else:
+        prev = close[..., :length - n]
+    for k in range(1, n + 1):
+        prev = (close[..., k:length - n + k] * c) + (prev * (1 - c))
+    out[..., n:] = prev
+    return out
+
+
+def stream_ema(close, n):
+    '''
+    out[..., i] equals streaming.EMA(n) after updates with close[..., :i + 1],
+    seeded with the sum of the first n closes, nan before that.
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    out = np.full(close.shape, NAN)
+    length = close.shape[-1]
+    if length < n:
+        return out
+    c = 2 / float(n + 1)
+    seed = np.zeros(close.shape[:-1])
+    for k in range(n):
+        seed += close[..., k]
+    prev = seed / n
+    out[..., n - 1] = prev
+    for i in range(n, length):
+        prev = close[..., i] * c + prev * (1 - c)
+        out[..., i] = prev
+    return out
+
+
+def sma(close, n=None):
+    '''
+    Rolling mean over n bars, or the expanding mean when n is None,
+    matching indicators.sma over the same slices.
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    if n is None:
+        counts = np.arange(1, close.shape[-1] + 1, dtype=np.float64)
+        return np.cumsum(close, axis=-1) / counts
+    out = np.full(close.shape, NAN)
+    length = close.shape[-1]
+    if length < n:
+        return out
+    total = np.zeros(close.shape[:-1] + (length - n + 1,))
+    for k in range(n):
+        total += close[..., k:length - n + 1 + k]
+    out[..., n - 1:] = total / n
+    return out
+
+
+def crossovers(fast, slow):
+    '''
+    1 for an up crossover, -1 for down and 0 otherwise, using the same
+    rule as EMATS._check_crossover on each (previous, current) pair.
+    '''
+    fast = np.asarray(fast)
+    slow = np.asarray(slow)
+    out = np.zeros(fast.shape, dtype=np.int8)
+    fp, fc = fast[..., :-1], fast[..., 1:]
+    sp, sc = slow[..., :-1], slow[..., 1:]
+    out[..., 1:][(fp < sp) & (fc > sc)] = 1
+    out[..., 1:][(fp > sp) & (fc < sc)] = -1
+    return out
+
+
+def round_off(num, div=0.1):
+    return div * np.round(num / div)
+
+
+def gann(price, direction='up'):
+    '''
+    Gann levels for any array of prices, the angle axis is appended last
+    so gann(p)[..., i] equals indicators.gann(p)[i].
+    '''
+    root = np.sqrt(np.asarray(price, dtype=np.float64))[..., np.newaxis]
+    angles = np.asarray(GANN_ANGLES)
+    if direction == 'up':
+        return round_off((root + angles) ** 2)
+    elif direction == 'down':
+        return round_off((root - angles) ** 2)
+    else:
+        return None
+
+
+def gann_grid(price):
+    return gann(price, 'up'), gann(price, 'down')
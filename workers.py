@@ -0,0 +1,142 @@
+from queue import Queue, Empty
+from threading import Thread
+from multiprocessing import Process, Queue as ProcessQueue
+from time import perf_counter
+from routing import Router
+from utils import create_logger
+
+SYMBOL_CHECK_FREQ = 1.0
+STOP_TIMEOUT = 5
+
+
+def run_strategies(name, router, inbound, intents):
+    '''
+    Worker body shared by thread and process workers. Messages arrive as
+    ('q' | 'o' | 't', message) tuples like bot.TradeBot uses and ('b', bar)
+    for closed bars, order intents and symbol changes go back to the
+    Manager on the intents queue.
+    '''
+    logger = create_logger(name)
+    last_check = perf_counter()
+    fed = {}
+    while True:
+        try:
+            item = inbound.get(timeout=SYMBOL_CHECK_FREQ)
+        except Empty:
+            item = ()
+        if item is None:
+            return
+        if item:
+            kind, m = item
+            try:
+                for strategy in router.get(m['symbol'].lower()):
+                    if kind == 'q':
+                        order = strategy.process_quote(m)
+                        if order is not None:
+                            intents.put(('order', name, order))
+                    elif kind == 'b':
+                        if m['interval'] in getattr(strategy, 'bar_intervals', ()):
+                            strategy.on_bar(m)
+                            fed[id(strategy)] = strategy
+                    elif kind == 'o':
+                        strategy.process_order(m)
+                    else:
+                        strategy.process_trade(m)
+            except Exception as e:
+                logger.exception('Exception while handling %s message' % kind)
+
+        if fed and inbound.empty():
+            for strategy in fed.values():
+                if hasattr(strategy, 'flush'):
+                    try:
+                        strategy.flush()
+                    except Exception as e:
+                        logger.exception('Exception while flushing bar updates')
+            fed = {}
+
+        if perf_counter() - last_check > SYMBOL_CHECK_FREQ:
+            last_check = perf_counter()
+            if router.refresh():
+                intents.put(('symbols', name, tuple(router.symbols())))
+
+
+class StrategyWorker:
+    '''
+    A group of strategies with their own inbound queue. To the Manager a
+    worker looks like a single strategy whose process_* calls only enqueue.
+    Runs them on a thread, subclasses swap in a process by changing
+    runner_class and queue_class together.
+    '''
+    queue_class = Queue
+    runner_class = Thread
+
+    def __init__(self, name, intents):
+        self.name = name
+        self.intents = intents
+        self.router = Router()
+        self.inbound = self.queue_class()
+        self.symbols = ()
+        self.runner = None
+
+    def add(self, strategy):
+        self.router.add(strategy)
+        self.symbols = tuple(self.router.symbols())
+
+    def get_symbols(self):
+        return self.symbols
+
+    @property
+    def bar_intervals(self):
+        intervals = set()
+        for strategy in self.router.strategies:
+            intervals.update(getattr(strategy, 'bar_intervals', ()))
+        return tuple(intervals)
+
+    @property
+    def bar_history(self):
+        return max([getattr(s, 'bar_history', 0) for s in self.router.strategies] or [0])
+
+    def process_quote(self, quote):
+        self.inbound.put(('q', quote))
+
+    def process_order(self, order):
+        self.inbound.put(('o', order))
+
+    def process_trade(self, trade):
+        self.inbound.put(('t', trade))
+
+    def on_bar(self, bar):
+        self.inbound.put(('b', bar))
+
+    def start(self):
+        self.runner = self._create_runner()
+        self.runner.start()
+
+    def stop(self):
+        if self.runner is None:
+            return
+        self.inbound.put(None)
+        self.runner.join(STOP_TIMEOUT)
+        self.runner = None
+
+    def _create_runner(self):
+        return self.runner_class(target=run_strategies, name=self.name, daemon=True,
+                                 args=(self.name, self.router, self.inbound, self.intents))
+
+
+class ThreadWorker(StrategyWorker):
+    queue_class = Queue
+    runner_class = Thread
+
+
+class ProcessWorker(StrategyWorker):
+    '''
+    Strategies are copied into the child process when it starts, so their
+    state in the parent goes stale from then on.
+    '''
+    queue_class = ProcessQueue
+    runner_class = Process
+
+
+WORKER_MODES = {'thread': (ThreadWorker, Queue),
+                'process': (ProcessWorker, ProcessQueue)}